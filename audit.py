@@ -0,0 +1,202 @@
+# audit.py — escritura diferida (write-behind) de registros de auditoría (operaciones;
+# creditos_historial lo escriben las RPC). Los handlers encolan y siguen; una tarea en segundo
+# plano inserta por lotes, reintenta y, si la base no responde, vuelca a un archivo local.
+import os, json, time, asyncio, itertools, logging
+
+from postgrest.types import ReturnMethod
+
+import db
+
+
+log = logging.getLogger("audit")
+
+AUDIT_BATCH = int(os.getenv("AUDIT_BATCH", "100"))          # filas por insert
+AUDIT_FLUSH = float(os.getenv("AUDIT_FLUSH", "2"))          # segundos máx. en cola
+AUDIT_RETRIES = int(os.getenv("AUDIT_RETRIES", "3"))
+AUDIT_SPILL = os.getenv("AUDIT_SPILL", "audit_spill.jsonl")
+
+# Tablas cuyas filas se actualizan después (hace falta el id que asigna la base)
+_CON_ID = {"operaciones"}
+
+
+class Fila:
+    __slots__ = ("k", "tabla", "row", "id", "estado")
+
+    def __init__(self, k: str, tabla: str, row: dict):
+        self.k, self.tabla, self.row = k, tabla, row
+        self.id = None
+        self.estado = "cola"     # cola → escrita | volcada
+
+
+_run = f"{int(time.time()):x}"   # las claves k de los volcados no chocan entre ejecuciones
+_seq = itertools.count(1)
+_cola: list = []                 # Fila (insert) o (Fila, dict) (update)
+_en_vuelo: dict[int, object] = {}   # id(item) -> item sacado de _cola y aún sin escribir ni volcar
+_hay = asyncio.Event()
+_lock = asyncio.Lock()
+_task: asyncio.Task | None = None
+
+
+def _wake():
+    global _task
+    _hay.set()
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_flusher())
+
+def insertar(tabla: str, row: dict) -> Fila:
+    f = Fila(f"{_run}-{next(_seq)}", tabla, row)
+    _cola.append(f)
+    _wake()
+    return f
+
+# Si el insert todavía no salió, el cambio se funde en la misma fila (una sola escritura)
+def actualizar(f: Fila, data: dict):
+    if f.estado == "cola":
+        f.row.update(data)
+        return
+    _cola.append((f, data))
+    _wake()
+
+def pendientes() -> int:
+    return len(_cola)
+
+
+async def _con_reintentos(fn):
+    for intento in range(AUDIT_RETRIES):
+        try:
+            return await fn()
+        except Exception as e:
+            if intento == AUDIT_RETRIES - 1:
+                raise
+            log.warning(f"audit: reintento {intento + 1} ({e})")
+            await asyncio.sleep(2 ** intento)
+
+def _volcar(lineas: list[dict]):
+    try:
+        with open(AUDIT_SPILL, "a", encoding="utf-8") as fh:
+            for ln in lineas:
+                fh.write(json.dumps(ln, ensure_ascii=False, default=str) + "\n")
+        log.warning(f"audit: {len(lineas)} registros volcados a {AUDIT_SPILL}")
+    except Exception as e:
+        log.error(f"audit: no se pudo volcar a {AUDIT_SPILL}: {e} — {lineas}")
+
+async def _insertar_lote(tabla: str, filas: list[Fila]):
+    rows = [f.row for f in filas]
+    for f in filas:
+        f.estado = "escrita"     # desde aquí los cambios van como update aparte
+    con_id = tabla in _CON_ID
+    q = lambda: db.run(db.table(tabla).insert(rows, returning=ReturnMethod.representation if con_id else ReturnMethod.minimal))
+    try:
+        r = await _con_reintentos(q)
+    except Exception as e:
+        log.warning(f"audit: insert en {tabla} falló ({e})")
+        for f in filas: f.estado = "volcada"
+        _volcar([_linea_insert(f) for f in filas])
+    else:
+        if con_id:
+            for f, row in zip(filas, r.data or []):
+                f.id = row.get("id")
+    for f in filas:
+        _en_vuelo.pop(id(f), None)
+
+async def _actualizar(item: tuple):
+    f, data = item
+    if f.estado == "volcada" or f.id is None:
+        _volcar([_linea_update(f, data)])
+    else:
+        try:
+            await _con_reintentos(lambda: db.run(db.table(f.tabla).update(data, returning=ReturnMethod.minimal).eq("id", f.id)))
+        except Exception as e:
+            log.warning(f"audit: update en {f.tabla} falló ({e})")
+            _volcar([_linea_update(f, data)])
+    _en_vuelo.pop(id(item), None)
+
+def _linea_insert(f: Fila) -> dict:
+    return {"op": "insert", "tabla": f.tabla, "k": f.k, "row": f.row}
+
+def _linea_update(f: Fila, data: dict) -> dict:
+    return {"op": "update", "tabla": f.tabla, "k": f.k, "id": f.id, "data": data}
+
+async def flush():
+    async with _lock:
+        await _flush()
+
+async def _flush():
+    global _cola
+    while _cola:
+        lote, _cola = _cola[:AUDIT_BATCH], _cola[AUDIT_BATCH:]
+        _en_vuelo.update((id(item), item) for item in lote)
+        inserts: dict[str, list[Fila]] = {}
+        updates = []
+        for item in lote:
+            if isinstance(item, Fila):
+                inserts.setdefault(item.tabla, []).append(item)
+            else:
+                updates.append(item)
+        # Primero los inserts: un update del mismo lote necesita el id
+        await asyncio.gather(*(_insertar_lote(t, fs) for t, fs in inserts.items()))
+        await asyncio.gather(*(_actualizar(u) for u in updates))
+
+async def _flusher():
+    while True:
+        _hay.clear()
+        if not _cola:
+            await _hay.wait()
+        t0 = time.monotonic()
+        while len(_cola) < AUDIT_BATCH and time.monotonic() - t0 < AUDIT_FLUSH:
+            _hay.clear()
+            try: await asyncio.wait_for(_hay.wait(), AUDIT_FLUSH - (time.monotonic() - t0))
+            except asyncio.TimeoutError: pass
+        try:
+            await flush()
+        except Exception as e:
+            log.warning(f"audit: flush error: {e}")
+
+# Al apagar: vacía la cola. Lo que no entre en la base (en cola o en un lote a medio escribir,
+# inserts y updates) queda en el archivo; los inserts primero, para que el reenvío tenga el id.
+async def drain(timeout: float = 15):
+    global _cola
+    try:
+        await asyncio.wait_for(flush(), timeout)
+    except Exception as e:
+        log.warning(f"audit: drain incompleto ({e!r})")
+        if _task is not None:
+            _task.cancel()           # que el flusher no termine después lo que se vuelca aquí
+        quedan = list(_en_vuelo.values()) + _cola
+        _en_vuelo.clear()
+        _cola = []
+        filas = [f for f in quedan if isinstance(f, Fila)]
+        for f in filas:
+            f.estado = "volcada"
+        _volcar([_linea_insert(f) for f in filas] + [_linea_update(f, d) for f, d in (x for x in quedan if not isinstance(x, Fila))])
+
+# Al arrancar: reintenta lo volcado en ejecuciones anteriores; lo que siga fallando se queda
+async def reenviar_volcados() -> int:
+    if not os.path.exists(AUDIT_SPILL):
+        return 0
+    with open(AUDIT_SPILL, encoding="utf-8") as fh:
+        lineas = [json.loads(ln) for ln in fh if ln.strip()]
+    quedan, n = [], 0
+    ids: dict[str, int] = {}     # k de un insert reenviado -> id
+    for ln in lineas:
+        try:
+            if ln["op"] == "insert":
+                r = await db.run(db.table(ln["tabla"]).insert(ln["row"]))
+                if r.data:
+                    ids[ln["k"]] = r.data[0].get("id")
+            else:
+                op_id = ln.get("id") or ids.get(ln["k"])
+                if op_id is None:
+                    raise RuntimeError("fila sin id")
+                await db.run(db.table(ln["tabla"]).update(ln["data"], returning=ReturnMethod.minimal).eq("id", op_id))
+            n += 1
+        except Exception:
+            quedan.append(ln)
+    tmp = AUDIT_SPILL + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        for ln in quedan:
+            fh.write(json.dumps(ln, ensure_ascii=False, default=str) + "\n")
+    os.replace(tmp, AUDIT_SPILL)
+    if not quedan:
+        os.remove(AUDIT_SPILL)
+    return n
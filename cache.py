@@ -0,0 +1,109 @@
+# cache.py — cachés en memoria del bot
+import time
+from collections import OrderedDict
+
+
+# LRU acotada con expiración por entrada
+class TTLCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data: OrderedDict = OrderedDict()   # key -> (expira, valor)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        if item[0] < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return item[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def purge(self) -> int:
+        now = time.monotonic()
+        viejas = [k for k, (exp, _) in self._data.items() if exp < now]
+        for k in viejas:
+            del self._data[k]
+        return len(viejas)
+
+    # (clave, valor, segundos de vida restantes) de las entradas vigentes
+    def items(self):
+        now = time.monotonic()
+        return [(k, v, exp - now) for k, (exp, v) in self._data.items() if exp >= now]
+
+
+# Índice local de asignaciones activas: correo -> (usuario_id, fecha_venc).
+# Lo mantienen las escrituras de db.py; una resincronización por páginas lo reconcilia
+# con la base (las escrituras locales posteriores a la lectura de una página prevalecen).
+class OwnershipIndex:
+    def __init__(self):
+        self._by_correo: dict[str, tuple[str, str | None]] = {}
+        self._gen = 0
+        self._written: dict[str, int] = {}   # correo -> generación de la última escritura local
+        self._seen: set[str] = set()
+        self._cycle_gen = 0
+
+    def __len__(self):
+        return len(self._by_correo)
+
+    def get(self, correo: str) -> tuple[str, str | None] | None:
+        return self._by_correo.get(correo)
+
+    def mark(self) -> int:
+        return self._gen
+
+    def _touch(self, correo: str):
+        self._gen += 1
+        self._written[correo] = self._gen
+
+    def set(self, correo: str, uid: str, fecha_venc: str | None):
+        self._touch(correo)
+        self._by_correo[correo] = (str(uid), fecha_venc)
+
+    def drop(self, correo: str, uid: str | None = None):
+        cur = self._by_correo.get(correo)
+        if cur is not None and (uid is None or cur[0] == str(uid)):
+            self._touch(correo)
+            del self._by_correo[correo]
+
+    def load(self, rows: list[dict]):
+        self._by_correo = {r["correo"]: (str(r["usuario_id"]), r.get("fecha_venc")) for r in rows}
+        self._written.clear()
+
+    # --- resincronización incremental
+    def begin_cycle(self):
+        self._seen = set()
+        self._cycle_gen = self._gen
+
+    def apply_page(self, rows: list[dict], since: int):
+        for r in rows:
+            c = r["correo"]
+            self._seen.add(c)
+            if self._written.get(c, 0) > since:
+                continue
+            self._by_correo[c] = (str(r["usuario_id"]), r.get("fecha_venc"))
+
+    def end_cycle(self) -> int:
+        stale = [c for c in self._by_correo
+                 if c not in self._seen and self._written.get(c, 0) <= self._cycle_gen]
+        for c in stale:
+            del self._by_correo[c]
+        self._written = {c: g for c, g in self._written.items() if g > self._cycle_gen}
+        self._seen = set()
+        return len(stale)
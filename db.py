@@ -0,0 +1,530 @@
+# db.py — capa de datos asíncrona sobre Supabase (PostgREST)
+import os, time, asyncio, logging
+
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from supabase import AClient
+
+import health
+from cache import TTLCache, OwnershipIndex
+
+
+log = logging.getLogger("db")
+
+# Máximo de peticiones simultáneas contra PostgREST (comparten una sola sesión HTTP keep-alive)
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", "8"))
+# Timeout por consulta: adaptativo (p99) entre estos límites, en segundos
+DB_TIMEOUT_MIN = float(os.getenv("DB_TIMEOUT_MIN", "10"))
+DB_TIMEOUT_MAX = float(os.getenv("DB_TIMEOUT_MAX", "60"))
+# Valores por filtro in_(...): acota el largo de la URL en operaciones masivas
+IN_CHUNK = int(os.getenv("DB_IN_CHUNK", "200"))
+
+# Caché de roles (write-through desde upsert_usuario)
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "50000"))
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "300"))
+
+# Índice de propiedad: tamaño de página al cargar/resincronizar y pausas del resync
+OWNERSHIP_PAGE = int(os.getenv("OWNERSHIP_PAGE", "1000"))
+OWNERSHIP_PAGE_PAUSE = float(os.getenv("OWNERSHIP_PAGE_PAUSE", "1"))
+OWNERSHIP_RESYNC = float(os.getenv("OWNERSHIP_RESYNC", "300"))
+
+# Cada cuánto se reconcilia usuarios.cuentas_asignadas con el conteo real (segundos)
+CUENTAS_RECONCILE = float(os.getenv("CUENTAS_RECONCILE", "3600"))
+
+# Filas por página en los listados de /cuentas
+LIST_PAGE = int(os.getenv("LIST_PAGE", "1000"))
+
+ADMIN_CLIENT_COLS = ["cliente_id", "cliente", "user_id", "clienteId", "client_id"]
+CLIENTES_CACHE_TTL = float(os.getenv("CLIENTES_CACHE_TTL", "600"))
+
+# Tablas/columnas que usa el bot (se validan al arrancar contra el esquema de PostgREST)
+ESQUEMA_REQUERIDO = {
+    "usuarios": ["telegram_id", "username", "rol", "creditos", "cuentas_asignadas"],
+    "asignaciones": ["id", "correo", "usuario_id", "fecha_venc", "asignado_por", "activo"],
+    "correos": ["correo", "vencimiento"],
+    "operaciones": ["id", "usuario_id", "tipo", "payload", "estado", "raw_resp"],
+    "creditos_historial": ["usuario_id", "delta", "motivo", "hecho_por"],
+    "reemplazos_solicitudes": ["id", "usuario_id", "correo", "motivo", "estado", "aprobado_por"],
+    "admin_clientes": ["admin_id"],
+}
+
+_sb: AClient | None = None
+_sem = asyncio.Semaphore(DB_CONCURRENCY)
+_ADMIN_CLIENT_COL_CACHE = None
+_roles = TTLCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL)    # telegram_id -> rol
+_admins = TTLCache(1, ROLE_CACHE_TTL)                # "ids" -> set de admins/owner
+_clientes = TTLCache(ROLE_CACHE_SIZE, CLIENTES_CACHE_TTL)   # admin_id -> set de clientes
+_esquema: dict[str, set[str]] = {}                    # tabla -> columnas (OpenAPI de PostgREST)
+propiedad = OwnershipIndex()                          # correo -> (usuario_id, fecha_venc) activos
+salud = health.de("base de datos", DB_TIMEOUT_MIN, DB_TIMEOUT_MAX)
+
+
+def init(url: str, key: str):
+    global _sb
+    _sb = AClient(url, key)
+
+def table(name: str):
+    return _sb.table(name)
+
+# Un error de PostgREST con código SQL/PGRST es una respuesta de una base sana (p.ej. columna
+# inexistente); cuentan como fallo de salud la red, los timeouts y los códigos de conexión/recursos.
+def _fallo_de_salud(e: Exception) -> bool:
+    if isinstance(e, APIError):
+        code = str(e.code or "")
+        return not code or code[:2] in ("08", "53", "57")
+    return True
+
+async def run(query):
+    prueba = salud.permitir()
+    try:
+        async with _sem:
+            t0 = time.monotonic()
+            try:
+                r = await asyncio.wait_for(query.execute(), salud.timeout())
+            except Exception as e:
+                if _fallo_de_salud(e): salud.fallo()
+                else: salud.exito()
+                raise
+            salud.exito(time.monotonic() - t0)
+            return r
+    finally:
+        if prueba: salud.soltar()       # prueba del semiabierto cancelada sin veredicto
+
+async def rpc(fn: str, params: dict):
+    return (await run(_sb.rpc(fn, params))).data
+
+async def close():
+    if _sb is not None:
+        try: await _sb.postgrest.aclose()
+        except Exception: pass
+
+
+# --- usuarios
+async def upsert_usuario(telegram_id: str, username: str, rol: str | None = None):
+    data = {"telegram_id": str(telegram_id), "username": username}
+    if rol is not None:
+        data["rol"] = rol
+    await run(table("usuarios").upsert(data))
+    if rol is not None:
+        _roles.set(str(telegram_id), rol)
+        _admins.clear()
+
+async def get_usuario(telegram_id: str, cols: str = "*"):
+    r = await run(table("usuarios").select(cols).eq("telegram_id", str(telegram_id)))
+    return r.data[0] if r.data else None
+
+async def get_role(telegram_id: str) -> str:
+    uid = str(telegram_id)
+    rol = _roles.get(uid)
+    if rol is not None:
+        return rol
+    try:
+        row = await get_usuario(uid, "rol")
+    except Exception:
+        return "user"   # el error no se cachea
+    rol = (row.get("rol", "user") or "user") if row else "user"
+    _roles.set(uid, rol)
+    return rol
+
+async def admin_ids() -> set[str]:
+    ids = _admins.get("ids")
+    if ids is not None:
+        return ids
+    r = await run(table("usuarios").select("telegram_id, rol").in_("rol", ["owner", "admin"]))
+    ids = set()
+    for row in r.data or []:
+        ids.add(str(row["telegram_id"]))
+        _roles.set(str(row["telegram_id"]), row["rol"])
+    _admins.set("ids", ids)
+    return ids
+
+# Calentamiento: roles de todos los usuarios (hasta llenar la caché), por páginas de telegram_id
+async def precargar_roles() -> int:
+    n, cursor = 0, None
+    while n < ROLE_CACHE_SIZE:
+        q = table("usuarios").select("telegram_id, rol").order("telegram_id").limit(min(LIST_PAGE, ROLE_CACHE_SIZE - n))
+        if cursor is not None:
+            q = q.gt("telegram_id", cursor)
+        page = (await run(q)).data or []
+        for row in page:
+            _roles.set(str(row["telegram_id"]), row.get("rol") or "user")
+        n += len(page)
+        if len(page) < LIST_PAGE:
+            break
+        cursor = page[-1]["telegram_id"]
+    return n
+
+async def get_creditos(uid: str) -> int:
+    row = await get_usuario(uid, "creditos")
+    if not row: return 0
+    try:
+        return int(row.get("creditos", 0))
+    except Exception:
+        return 0
+
+# cuentas_asignadas lo mantiene un trigger sobre asignaciones (sql/003_cuentas_asignadas.sql);
+# esta tarea solo corrige de vez en cuando lo que se haya desviado.
+async def reconciliar_cuentas():
+    while True:
+        await asyncio.sleep(CUENTAS_RECONCILE)
+        try:
+            n = await rpc("reconciliar_cuentas_asignadas", {})
+            if n:
+                log.info(f"cuentas_asignadas: {n} usuarios reconciliados")
+        except Exception as e:
+            log.warning(f"reconciliar_cuentas error: {e}")
+
+
+# --- esquema
+# Se resuelve una vez al arrancar desde el OpenAPI de PostgREST (raíz /rest/v1/): qué columnas
+# tiene cada tabla, si falta alguna de las que usa el bot y cuál es la columna del cliente en
+# admin_clientes. Si el OpenAPI no está expuesto, la columna se detecta probando una vez.
+async def descubrir_esquema() -> list[str]:
+    global _ADMIN_CLIENT_COL_CACHE
+    faltan = []
+    try:
+        r = await asyncio.wait_for(_sb.postgrest.session.get("/", headers={"Accept": "application/openapi+json"}), DB_TIMEOUT_MAX)
+        r.raise_for_status()
+        defs = r.json().get("definitions") or {}
+        _esquema.update({t: set((d.get("properties") or {}).keys()) for t, d in defs.items()})
+    except Exception as e:
+        log.warning(f"OpenAPI de PostgREST no disponible ({e}); se detecta admin_clientes probando")
+    if _esquema:
+        for t, cols in ESQUEMA_REQUERIDO.items():
+            if t not in _esquema:
+                faltan.append(f"tabla {t}")
+            else:
+                faltan += [f"{t}.{c}" for c in cols if c not in _esquema[t]]
+        col = next((c for c in ADMIN_CLIENT_COLS if c in _esquema.get("admin_clientes", ())), None)
+        if col is None:
+            faltan.append("admin_clientes.<columna de cliente>")
+        _ADMIN_CLIENT_COL_CACHE = col or "cliente_id"
+    else:
+        await detect_admin_client_col()
+    return faltan
+
+
+# --- admin_clientes
+async def detect_admin_client_col() -> str:
+    global _ADMIN_CLIENT_COL_CACHE
+    if _ADMIN_CLIENT_COL_CACHE:
+        return _ADMIN_CLIENT_COL_CACHE
+    for col in ADMIN_CLIENT_COLS:
+        try:
+            await run(table("admin_clientes").select(col).limit(1))
+            _ADMIN_CLIENT_COL_CACHE = col
+            return col
+        except Exception:
+            continue
+    _ADMIN_CLIENT_COL_CACHE = "cliente_id"
+    return _ADMIN_CLIENT_COL_CACHE
+
+# admin -> ids de sus clientes (caché; la invalida upsert_admin_cliente)
+async def admin_client_ids(admin_id: str) -> set[str]:
+    aid = str(admin_id)
+    ids = _clientes.get(aid)
+    if ids is not None:
+        return ids
+    col = await detect_admin_client_col()
+    r = await run(table("admin_clientes").select(col).eq("admin_id", aid))
+    ids = {str(x.get(col)) for x in (r.data or []) if x.get(col)}
+    _clientes.set(aid, ids)
+    return ids
+
+async def admin_has_clients(admin_id: str) -> bool:
+    return bool(await admin_client_ids(admin_id))
+
+async def upsert_admin_cliente(admin_id: str, cliente_id: str) -> str:
+    col = await detect_admin_client_col()
+    try:
+        await run(table("admin_clientes").upsert({"admin_id": str(admin_id), col: str(cliente_id)}))
+    except Exception as e:
+        raise RuntimeError(f"No pude escribir en admin_clientes.{col}. Revisa columnas. {e}")
+    finally:
+        _clientes.pop(str(admin_id))
+    return col
+
+
+# --- asignaciones / correos
+# Las lecturas por correo salen del índice de propiedad; si no hay dato, van a la base.
+async def correo_asignado_a_usuario(uid: str, correo: str) -> bool:
+    hit = propiedad.get(correo)
+    if hit and hit[0] == str(uid):
+        return True
+    r = await run(table("asignaciones").select("fecha_venc").eq("usuario_id", uid).eq("correo", correo).eq("activo", True))
+    if r.data:
+        propiedad.set(correo, uid, r.data[0].get("fecha_venc"))
+    return bool(r.data)
+
+async def buscar_duenho_por_correo_activo(correo: str):
+    hit = propiedad.get(correo)
+    if hit:
+        return {"usuario_id": hit[0], "fecha_venc": hit[1]}
+    r = await run(table("asignaciones").select("usuario_id, fecha_venc").eq("correo", correo).eq("activo", True))
+    if r.data:
+        propiedad.set(correo, r.data[0]["usuario_id"], r.data[0].get("fecha_venc"))
+    return r.data[0] if r.data else None
+
+async def obtener_asignacion_activa(uid: str, correo: str):
+    hit = propiedad.get(correo)
+    if hit and hit[0] == str(uid):
+        return {"usuario_id": hit[0], "correo": correo, "fecha_venc": hit[1]}
+    r = await run(table("asignaciones").select("*").eq("usuario_id", uid).eq("correo", correo).eq("activo", True))
+    if r.data:
+        propiedad.set(correo, uid, r.data[0].get("fecha_venc"))
+    return r.data[0] if r.data else None
+
+# Listado de asignaciones activas (todas o de un usuario) ordenado por la base por
+# (fecha_venc, id) y paginado por keyset: sin tope de filas y sin OFFSET. Las filas sin
+# fecha van al final, por id.
+async def iter_asignaciones_activas(usuario_id: str | None = None, page: int = LIST_PAGE):
+    def base():
+        q = table("asignaciones").select("id, usuario_id, correo, fecha_venc").eq("activo", True)
+        return q.eq("usuario_id", str(usuario_id)) if usuario_id is not None else q
+
+    last = None
+    while True:
+        q = base().not_.is_("fecha_venc", "null")
+        if last is not None:
+            q = q.or_(f"fecha_venc.gt.{last[0]},and(fecha_venc.eq.{last[0]},id.gt.{last[1]})")
+        rows = (await run(q.order("fecha_venc").order("id").limit(page))).data or []
+        for r in rows:
+            yield r
+        if len(rows) < page:
+            break
+        last = (rows[-1]["fecha_venc"], rows[-1]["id"])
+
+    cursor = None
+    while True:
+        q = base().is_("fecha_venc", "null")
+        if cursor is not None:
+            q = q.gt("id", cursor)
+        rows = (await run(q.order("id").limit(page))).data or []
+        for r in rows:
+            yield r
+        if len(rows) < page:
+            break
+        cursor = rows[-1]["id"]
+
+# Lo mismo para un admin y sus clientes: el cruce con admin_clientes se hace en la base
+# (sql/006_asignaciones_admin.sql), así que no viajan listas de ids en la URL.
+async def iter_asignaciones_admin(admin_id: str, page: int = LIST_PAGE):
+    col = await detect_admin_client_col()
+    for sin_fecha in (False, True):
+        fecha = id_ = None
+        while True:
+            rows = await rpc("asignaciones_admin_pagina", {
+                "p_admin_id": str(admin_id), "p_col": col, "p_sin_fecha": sin_fecha,
+                "p_fecha": fecha, "p_id": id_, "p_limit": page,
+            }) or []
+            for r in rows:
+                yield r
+            if len(rows) < page:
+                break
+            fecha, id_ = rows[-1]["fecha_venc"], rows[-1]["id"]
+
+async def insertar_asignacion(correo: str, uid: str, fecha_venc: str, asignado_por: str):
+    await run(table("asignaciones").insert({
+        "correo": correo, "usuario_id": uid, "fecha_venc": fecha_venc,
+        "asignado_por": asignado_por, "activo": True
+    }))
+    propiedad.set(correo, uid, fecha_venc)
+
+async def actualizar_venc_asignacion(uid: str, correo: str, fecha_venc: str):
+    await run(table("asignaciones").update({"fecha_venc": fecha_venc}).eq("usuario_id", uid).eq("correo", correo).eq("activo", True))
+    propiedad.set(correo, uid, fecha_venc)
+
+async def desactivar_asignacion(uid: str, correo: str):
+    await run(table("asignaciones").update({"activo": False}).eq("usuario_id", uid).eq("correo", correo).eq("activo", True))
+    propiedad.drop(correo, uid)
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def asignaciones_activas_de(correos: list[str]) -> list[dict]:
+    r = await run(table("asignaciones").select("id, correo, usuario_id, fecha_venc").in_("correo", correos).eq("activo", True))
+    return r.data or []
+
+# Asignación masiva: por lote, una lectura de dueños actuales, clasificación en memoria
+# (conflicto / actualizar / insertar) y una escritura por clase. Devuelve {correo: error}.
+async def asignar_lote(target: str, rows: dict[str, str], asignado_por: str = "admin") -> dict[str, str]:
+    target = str(target)
+    errores: dict[str, str] = {}
+    for parte in _chunks(list(rows.items()), IN_CHUNK):
+        parte = dict(parte)
+        try:
+            activas = await asignaciones_activas_de(list(parte))
+        except Exception as e:
+            errores.update({c: str(e) for c in parte}); continue
+
+        propias = {}
+        for a in activas:
+            if str(a["usuario_id"]) != target:
+                errores[a["correo"]] = "correo asignado a otro usuario"
+            else:
+                propias[a["correo"]] = a
+        validos = {c: f for c, f in parte.items() if c not in errores}
+        if not validos:
+            continue
+
+        # Las actualizaciones se agrupan por fecha: un UPDATE ... id IN (...) por fecha distinta
+        por_fecha: dict[str, list] = {}
+        for c, f in validos.items():
+            if c in propias:
+                por_fecha.setdefault(f, []).append(propias[c]["id"])
+        nuevas = [
+            {"correo": c, "usuario_id": target, "fecha_venc": f, "asignado_por": asignado_por, "activo": True}
+            for c, f in validos.items() if c not in propias
+        ]
+        try:
+            await upsert_correos([{"correo": c, "vencimiento": f} for c, f in validos.items()])
+            for f, ids in por_fecha.items():
+                await run(table("asignaciones").update({"fecha_venc": f}, returning=ReturnMethod.minimal).in_("id", ids))
+            if nuevas:
+                await run(table("asignaciones").insert(nuevas, returning=ReturnMethod.minimal))
+        except Exception as e:
+            errores.update({c: str(e) for c in validos})
+            continue
+        for c, f in validos.items():
+            propiedad.set(c, target, f)
+    return errores
+
+# Remoción masiva: un UPDATE por lote. Devuelve {correo: error}.
+async def desactivar_asignaciones(uid: str, correos: list[str]) -> dict[str, str]:
+    errores: dict[str, str] = {}
+    for parte in _chunks(correos, IN_CHUNK):
+        try:
+            await run(table("asignaciones").update({"activo": False}, returning=ReturnMethod.minimal)
+                      .eq("usuario_id", str(uid)).in_("correo", parte).eq("activo", True))
+        except Exception as e:
+            errores.update({c: str(e) for c in parte})
+            continue
+        for c in parte:
+            propiedad.drop(c, uid)
+    return errores
+
+# --- índice de propiedad: carga completa y resincronización incremental (keyset por id)
+async def _pagina_activas(desde_id, limit: int) -> list[dict]:
+    r = await run(table("asignaciones").select("id, correo, usuario_id, fecha_venc")
+                  .eq("activo", True).gt("id", desde_id).order("id").limit(limit))
+    return r.data or []
+
+async def cargar_propiedad() -> int:
+    rows, cursor = [], 0
+    while True:
+        page = await _pagina_activas(cursor, OWNERSHIP_PAGE)
+        rows += page
+        if len(page) < OWNERSHIP_PAGE:
+            break
+        cursor = page[-1]["id"]
+    propiedad.load(rows)
+    return len(rows)
+
+async def resync_propiedad():
+    while True:
+        await asyncio.sleep(OWNERSHIP_RESYNC)
+        try:
+            propiedad.begin_cycle()
+            cursor = 0
+            while True:
+                since = propiedad.mark()
+                page = await _pagina_activas(cursor, OWNERSHIP_PAGE)
+                propiedad.apply_page(page, since)
+                if len(page) < OWNERSHIP_PAGE:
+                    break
+                cursor = page[-1]["id"]
+                await asyncio.sleep(OWNERSHIP_PAGE_PAUSE)
+            quitados = propiedad.end_cycle()
+            if quitados:
+                log.info(f"índice de propiedad: {quitados} asignaciones ya inactivas")
+        except Exception as e:
+            log.warning(f"resync_propiedad error: {e}")
+
+async def upsert_correo(correo: str, vencimiento: str):
+    await run(table("correos").upsert({"correo": correo, "vencimiento": vencimiento}, on_conflict="correo"))
+
+async def upsert_correos(rows: list[dict]):
+    if rows:
+        await run(table("correos").upsert(rows, on_conflict="correo", returning=ReturnMethod.minimal))
+
+
+# --- liquidaciones (funciones en sql/001_liquidaciones.sql): una transacción por llamada
+async def liquidar_compra(uid: str, correo: str, dias: int = 30, cobrar: bool = True) -> dict:
+    res = await rpc("liquidar_compra", {"p_usuario_id": str(uid), "p_correo": correo, "p_dias": dias, "p_cobrar": cobrar})
+    if not res.get("error"):
+        propiedad.set(correo, uid, res["fecha_venc"])
+    return res
+
+async def liquidar_renovacion(uid: str, correo: str, dias: int = 30) -> dict:
+    res = await rpc("liquidar_renovacion", {"p_usuario_id": str(uid), "p_correo": correo, "p_dias": dias})
+    if not res.get("error"):
+        propiedad.set(correo, uid, res["fecha_venc"])
+    return res
+
+async def liquidar_reemplazo(req_id: int, uid: str, viejo: str, nuevo: str, dias: int = 30) -> dict:
+    res = await rpc("liquidar_reemplazo", {
+        "p_solicitud_id": req_id, "p_usuario_id": str(uid), "p_viejo": viejo, "p_nuevo": nuevo, "p_dias": dias
+    })
+    propiedad.drop(viejo, uid)
+    propiedad.set(nuevo, uid, res["fecha_venc"])
+    return res
+
+async def reservar_creditos(uid: str, cantidad: int) -> dict:
+    return await rpc("reservar_creditos", {"p_usuario_id": str(uid), "p_cantidad": cantidad})
+
+async def devolver_creditos(uid: str, cantidad: int) -> dict:
+    return await rpc("devolver_creditos", {"p_usuario_id": str(uid), "p_cantidad": cantidad})
+
+async def transferir_creditos(origen: str, destinos: list[str], cantidad: int, debitar: bool = True) -> dict:
+    return await rpc("transferir_creditos", {
+        "p_origen": str(origen), "p_destinos": [str(d) for d in destinos],
+        "p_cantidad": cantidad, "p_debitar": debitar,
+    })
+
+
+# --- operaciones
+# Marca como fallidas todas las 'pendiente'. Solo al arrancar: el registro en memoria está vacío,
+# así que ninguna sigue viva (un corte por created_at dejaría vivas las recientes y las reenviadas
+# desde el volcado, que reciben created_at = now() al insertarse).
+async def expirar_operaciones() -> int:
+    data = {"estado": "fallido", "raw_resp": "expirada (reinicio)"}
+    r = await run(table("operaciones").update(data).eq("estado", "pendiente"))
+    return len(r.data or [])
+
+
+# --- reemplazos_solicitudes
+async def crear_reemplazo(data: dict) -> dict:
+    r = await run(table("reemplazos_solicitudes").insert(data))
+    return r.data[0]
+
+async def get_reemplazo(req_id: int):
+    r = await run(table("reemplazos_solicitudes").select("*").eq("id", req_id))
+    return r.data[0] if r.data else None
+
+async def actualizar_reemplazo(req_id: int, data: dict):
+    await run(table("reemplazos_solicitudes").update(data).eq("id", req_id))
+
+# Cambio de estado condicionado al actual: si otro admin ya la gestionó, devuelve None
+async def cambiar_estado_reemplazo(req_id: int, desde: str, data: dict):
+    r = await run(table("reemplazos_solicitudes").update(data).eq("id", req_id).eq("estado", desde))
+    return r.data[0] if r.data else None
+
+# Página de solicitudes pendientes por keyset sobre id: desde (>=) hacia adelante o hasta (<=)
+# hacia atrás. Devuelve (filas en orden ascendente, hay más en esa dirección).
+async def pagina_reemplazos_pendientes(desde: int | None = None, hasta: int | None = None, n: int = 10):
+    q = table("reemplazos_solicitudes").select("id, usuario_id, correo, motivo").eq("estado", "pendiente")
+    if hasta is not None:
+        r = await run(q.lte("id", hasta).order("id", desc=True).limit(n + 1))
+        rows = r.data or []
+        return list(reversed(rows[:n])), len(rows) > n
+    if desde is not None:
+        q = q.gte("id", desde)
+    r = await run(q.order("id").limit(n + 1))
+    rows = r.data or []
+    return rows[:n], len(rows) > n
+
+# Solicitudes enviadas al VIP y sin respuesta, en orden de envío
+async def reemplazos_en_curso() -> list[dict]:
+    r = await run(table("reemplazos_solicitudes").select("id, usuario_id, correo").eq("estado", "aceptado").order("id"))
+    return r.data or []
@@ -0,0 +1,115 @@
+# difusion.py — avisos del bot a varios destinatarios (admins) por la Bot API
+# Los handlers encolan y siguen. Cada aviso sale a todos a la vez, al ritmo de un bucket global,
+# y ante RetryAfter se reprograma. Si un tipo de evento llega en ráfaga, se agrupa en un resumen.
+import os, time, asyncio, logging
+from collections import deque
+
+from telegram import InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import RetryAfter
+
+from outbound import TokenBucket
+
+
+log = logging.getLogger("difusion")
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))       # mensajes/seg (límite global ~30)
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", "3"))
+# Más de DIGEST_UMBRAL eventos de un grupo en DIGEST_WINDOW segundos → un resumen por ventana
+DIGEST_UMBRAL = int(os.getenv("DIGEST_UMBRAL", "5"))
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "60"))
+DIGEST_MAX_LINEAS = 30
+
+
+class _Grupo:
+    __slots__ = ("titulo", "recientes", "lineas", "botones", "flush")
+
+    def __init__(self, titulo: str):
+        self.titulo = titulo
+        self.recientes: deque[float] = deque()
+        self.lineas: list[str] = []
+        self.botones: list[list] = []
+        self.flush: asyncio.TimerHandle | None = None
+
+
+class Difusion:
+    def __init__(self, destinatarios):
+        self.bot = None
+        self.destinatarios = destinatarios      # async () -> iterable de chat_id
+        self._cola: asyncio.Queue = asyncio.Queue()
+        self._bucket = TokenBucket(BROADCAST_RATE, int(BROADCAST_RATE))
+        self._grupos: dict[str, _Grupo] = {}
+        self._task: asyncio.Task | None = None
+        self.enviados = 0
+        self.fallidos = 0
+        self.resumenes = 0
+
+    def iniciar(self, bot):
+        self.bot = bot
+
+    def _encolar(self, text: str, keyboard: InlineKeyboardMarkup | None):
+        self._cola.put_nowait((text, keyboard))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    # grupo/titulo/linea: si hay ráfaga del mismo grupo, el aviso se acumula como `linea`
+    # (con `botones`, o las filas de su teclado) en un resumen que sale al cerrar la ventana.
+    def publicar(self, text: str, keyboard: InlineKeyboardMarkup | None = None,
+                 grupo: str | None = None, titulo: str = "", linea: str = "", botones: list | None = None):
+        if grupo is None:
+            return self._encolar(text, keyboard)
+        g = self._grupos.get(grupo)
+        if g is None:
+            g = self._grupos[grupo] = _Grupo(titulo or grupo)
+        now = time.monotonic()
+        while g.recientes and now - g.recientes[0] > DIGEST_WINDOW:
+            g.recientes.popleft()
+        g.recientes.append(now)
+        if len(g.recientes) <= DIGEST_UMBRAL and g.flush is None:
+            return self._encolar(text, keyboard)
+        g.lineas.append(linea or text)
+        if botones is not None:
+            g.botones.append(botones)
+        elif keyboard is not None:
+            g.botones.extend(list(row) for row in keyboard.inline_keyboard)
+        if g.flush is None:
+            g.flush = asyncio.get_running_loop().call_later(DIGEST_WINDOW, self._resumen, g)
+
+    def _resumen(self, g: _Grupo):
+        g.flush = None
+        if not g.lineas:
+            return
+        n = len(g.lineas)
+        cuerpo = "\n".join(g.lineas[:DIGEST_MAX_LINEAS]) + (f"\n… y {n - DIGEST_MAX_LINEAS} más" if n > DIGEST_MAX_LINEAS else "")
+        kb = InlineKeyboardMarkup(g.botones[:DIGEST_MAX_LINEAS]) if g.botones else None
+        g.lineas, g.botones = [], []
+        self.resumenes += 1
+        self._encolar(f"{g.titulo} ({n})\n{cuerpo}", kb)
+
+    async def _enviar(self, chat_id: int, text: str, keyboard):
+        for _ in range(BROADCAST_RETRIES + 1):
+            await self._bucket.take()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+                self.enviados += 1
+                return
+            except RetryAfter as e:
+                log.warning(f"RetryAfter {e.retry_after}s al avisar a {chat_id}")
+                await asyncio.sleep(e.retry_after + 0.5)
+            except Exception as e:
+                log.debug(f"No se pudo avisar a {chat_id}: {e}")
+                break
+        self.fallidos += 1
+
+    async def _worker(self):
+        while True:
+            text, keyboard = await self._cola.get()
+            try:
+                ids = [int(x) for x in await self.destinatarios()]
+                # Todos a la vez; el siguiente aviso espera a este (orden por destinatario)
+                await asyncio.gather(*(self._enviar(cid, text, keyboard) for cid in ids))
+            except Exception as e:
+                log.warning(f"difusión fallida: {e}")
+
+    def stats(self) -> dict:
+        return {"cola": self._cola.qsize(), "enviados": self.enviados, "fallidos": self.fallidos, "resumenes": self.resumenes}
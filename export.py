@@ -0,0 +1,65 @@
+# export.py — exportación de filas a documento (txt/csv, opcional gzip) sin archivos temporales
+import io, os, csv, gzip, shutil, tempfile
+
+
+# En memoria hasta este tamaño; por encima el buffer se vuelca solo a disco
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Exportaciones sin comprimir que superen esto se envían en .gz (límite de subida de Telegram)
+EXPORT_GZIP_BYTES = int(os.getenv("EXPORT_GZIP_BYTES", str(20 * 1024 * 1024)))
+
+
+def _spool():
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+
+def _gzip_copy(src):
+    dst = _spool()
+    try:
+        src.seek(0)
+        with gzip.GzipFile(fileobj=dst, mode="wb") as gz:
+            shutil.copyfileobj(src, gz, 64 * 1024)
+    except BaseException:
+        dst.close()
+        raise
+    finally:
+        src.close()
+    return dst
+
+# Vuelca las filas (iterable asíncrono de tuplas) a un buffer a medida que llegan.
+# Devuelve (buffer posicionado al inicio, filas escritas, comprimido).
+async def build_export(rows, header: list[str], fmt: str = "txt", comprimir: bool = False):
+    buf = _spool()
+    raw = gzip.GzipFile(fileobj=buf, mode="wb") if comprimir else buf
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="" if fmt == "csv" else "\n")
+    writer = csv.writer(text) if fmt == "csv" else None
+
+    def write(cols):
+        if writer is not None:
+            writer.writerow(cols)
+        else:
+            text.write(" | ".join(str(c) for c in cols) + "\n")
+
+    # Si el iterador (la base) falla a mitad, el buffer (o su archivo temporal) se libera igual
+    n = 0
+    try:
+        if header:
+            write(header)
+        async for cols in rows:
+            write(cols)
+            n += 1
+        text.flush()
+        text.detach()
+        if comprimir:
+            raw.close()
+    except BaseException:
+        try: text.close()
+        except Exception: pass
+        buf.close()
+        raise
+
+    if not comprimir and buf.tell() > EXPORT_GZIP_BYTES:
+        buf, comprimir = _gzip_copy(buf), True
+    buf.seek(0)
+    return buf, n, comprimir
+
+def export_filename(base: str, fmt: str, comprimido: bool) -> str:
+    return f"{base}.{'csv' if fmt == 'csv' else 'txt'}" + (".gz" if comprimido else "")
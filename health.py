@@ -0,0 +1,108 @@
+# health.py — salud de cada dependencia (bots externos, base de datos)
+# Latencias recientes → timeout adaptativo (p99 × margen, acotado) y circuit breaker:
+# tras HEALTH_FALLOS fallos seguidos se abre y falla al instante; pasado HEALTH_ENFRIAMIENTO
+# deja pasar una sola prueba (semiabierto) que lo cierra o lo vuelve a abrir.
+import os, time
+from collections import deque
+
+
+HEALTH_MUESTRAS = int(os.getenv("HEALTH_MUESTRAS", "200"))
+HEALTH_MIN_MUESTRAS = int(os.getenv("HEALTH_MIN_MUESTRAS", "20"))
+HEALTH_MARGEN = float(os.getenv("HEALTH_MARGEN", "2"))
+HEALTH_FALLOS = int(os.getenv("HEALTH_FALLOS", "5"))
+HEALTH_ENFRIAMIENTO = float(os.getenv("HEALTH_ENFRIAMIENTO", "60"))
+
+CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    def __init__(self, nombre: str, reintento: float):
+        super().__init__(f"{nombre} no disponible (reintento en {reintento:.0f}s)")
+        self.nombre, self.reintento = nombre, reintento
+
+
+class Salud:
+    def __init__(self, nombre: str, timeout_min: float, timeout_max: float):
+        self.nombre = nombre
+        self.timeout_min, self.timeout_max = timeout_min, timeout_max
+        self._lat: deque[float] = deque(maxlen=HEALTH_MUESTRAS)
+        self.estado = CERRADO
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self._prueba = False
+        self.rechazadas = 0
+
+    def percentil(self, p: float) -> float | None:
+        if not self._lat:
+            return None
+        s = sorted(self._lat)
+        return s[min(len(s) - 1, int(p * len(s)))]
+
+    # Sin historial suficiente se usa el tope
+    def timeout(self) -> float:
+        if len(self._lat) < HEALTH_MIN_MUESTRAS:
+            return self.timeout_max
+        return max(self.timeout_min, min(self.timeout_max, self.percentil(0.99) * HEALTH_MARGEN))
+
+    def _restante(self) -> float:
+        return max(0.0, self.abierto_hasta - time.monotonic())
+
+    # Consulta sin consumir la prueba del semiabierto (para avisar antes de empezar una operación)
+    def disponible(self) -> bool:
+        return self.estado == CERRADO or (self._restante() == 0 and not self._prueba)
+
+    # True si esta llamada se quedó con la prueba del semiabierto (debe soltarla si no hay veredicto)
+    def permitir(self) -> bool:
+        if self.estado == CERRADO:
+            return False
+        if self.estado == ABIERTO and self._restante() == 0:
+            self.estado = SEMIABIERTO
+        if self.estado == SEMIABIERTO and not self._prueba:
+            self._prueba = True
+            return True
+        self.rechazadas += 1
+        raise CircuitoAbierto(self.nombre, self._restante())
+
+    # La prueba del semiabierto terminó sin veredicto (cancelada, cola propia llena…): la suelta
+    # solo quien la tomó (permitir() devolvió True)
+    def soltar(self):
+        if self.estado == SEMIABIERTO:
+            self._prueba = False
+
+    def exito(self, latencia: float | None = None):
+        if latencia is not None:
+            self._lat.append(latencia)
+        self.fallos = 0
+        self._prueba = False
+        self.estado = CERRADO
+
+    def fallo(self):
+        self.fallos += 1
+        self._prueba = False
+        if self.estado == SEMIABIERTO or self.fallos >= HEALTH_FALLOS:
+            self.estado = ABIERTO
+            self.abierto_hasta = time.monotonic() + HEALTH_ENFRIAMIENTO
+
+    def stats(self) -> dict:
+        p50, p99 = self.percentil(0.5), self.percentil(0.99)
+        return {
+            "estado": self.estado if self.estado != ABIERTO else f"abierto ({self._restante():.0f}s)",
+            "p50": f"{p50:.1f}s" if p50 is not None else "-",
+            "p99": f"{p99:.1f}s" if p99 is not None else "-",
+            "timeout": f"{self.timeout():.0f}s",
+            "fallos": self.fallos,
+            "rechazadas": self.rechazadas,
+        }
+
+
+_salud: dict[str, Salud] = {}
+
+
+def de(nombre: str, timeout_min: float = 30, timeout_max: float = 300) -> Salud:
+    s = _salud.get(nombre)
+    if s is None:
+        s = _salud[nombre] = Salud(nombre, timeout_min, timeout_max)
+    return s
+
+def todas() -> list[Salud]:
+    return list(_salud.values())
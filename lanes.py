@@ -0,0 +1,90 @@
+# lanes.py — carril por usuario: updates de un mismo usuario en orden, usuarios distintos en paralelo
+# La espera en el carril ocurre dentro de un hueco de concurrent_updates de PTB: por eso cada
+# usuario puede tener como mucho LANE_MAX_ESPERA updates esperando; los demás se descartan.
+import os, asyncio, functools, contextvars, logging
+
+
+log = logging.getLogger("lanes")
+
+LANE_MAX_ESPERA = int(os.getenv("LANE_MAX_ESPERA", "3"))
+
+
+class _Lane:
+    __slots__ = ("lock", "users", "esperando", "avisado")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.esperando = 0
+        self.avisado = False
+
+
+_lanes: dict[int, _Lane] = {}
+_release = contextvars.ContextVar("lane_release", default=None)
+descartados = 0
+
+
+# Un solo aviso por racha de descartes (si no, el aviso también saturaría)
+async def _rechazar(update, lane: _Lane):
+    global descartados
+    descartados += 1
+    if lane.avisado:
+        return
+    lane.avisado = True
+    texto = "⏳ Aún estoy procesando tus mensajes anteriores; ignoré los nuevos. Espera un momento."
+    try:
+        if getattr(update, "callback_query", None) is not None:
+            await update.callback_query.answer(texto)
+        elif update.effective_message is not None:
+            await update.effective_message.reply_text(texto)
+    except Exception as e:
+        log.debug(f"No se pudo avisar del descarte: {e}")
+
+
+def per_user(callback):
+    @functools.wraps(callback)
+    async def _run(update, context):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            return await callback(update, context)
+
+        key = user.id
+        lane = _lanes.get(key)
+        if lane is None:
+            lane = _lanes[key] = _Lane()
+        elif lane.esperando >= LANE_MAX_ESPERA:
+            return await _rechazar(update, lane)
+        lane.users += 1
+        held = False
+
+        def release():
+            nonlocal held
+            if held:
+                held = False
+                lane.lock.release()
+
+        try:
+            lane.esperando += 1
+            try:
+                await lane.lock.acquire()
+            finally:
+                lane.esperando -= 1
+            held = True
+            token = _release.set(release)
+            try:
+                return await callback(update, context)
+            finally:
+                _release.reset(token)
+        finally:
+            release()
+            lane.users -= 1
+            if lane.users == 0 and _lanes.get(key) is lane:
+                del _lanes[key]
+    return _run
+
+# Libera el carril antes de terminar el handler (p.ej. tras registrar la operación pendiente
+# y antes de esperar al bot externo): el siguiente update del usuario ya verá la acción pendiente.
+def release_lane():
+    fn = _release.get()
+    if fn is not None:
+        fn()
@@ -1,5 +1,5 @@
-import os, re, json, time, asyncio, logging, tempfile, html
-from datetime import datetime, timedelta
+import os, re, time, asyncio, logging, html
+from datetime import datetime
 
 
 import nest_asyncio
@@ -24,7 +24,6 @@ if not API_ID or not API_HASH or not BOT_TOKEN or not SUPABASE_URL or not SUPABA
     raise SystemExit("❌ Faltan variables en .env: " + ", ".join(faltan))
 
 
-from supabase import create_client, Client
 from telethon import TelegramClient, events
 
 
@@ -39,6 +38,23 @@ from telegram.ext import (
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 log = logging.getLogger("bot")
 
+import db
+import outbound
+import operaciones
+import audit
+import ratelimit
+import difusion
+import reemplazos
+import health
+import lanes
+from cache import TTLCache
+from export import build_export, export_filename
+from lanes import per_user, release_lane
+from db import (
+    upsert_usuario, get_role, get_creditos, admin_client_ids,
+    buscar_duenho_por_correo_activo, obtener_asignacion_activa, correo_asignado_a_usuario,
+)
+
 
 OWNER_ID = "2016769834"
 SEED_ADMIN_IDS = {"7988910268"}
@@ -47,20 +63,39 @@ SERVICIO_VIP = "@Servicio_VIPBot"
 CODIGOS_NETFLIX = "@codigosnetflix_bot"
 VIP_REEMPLAZARBOT = "@VIPREEMPLAZARBOT"
 
-COOLDOWN_SECONDS = 5.5
 WAIT_TIMEOUT = 300
 
+# Respuestas de los bots externos
+CUENTA_RE = re.compile(r"Cuenta:\s*([^\s:@]+@[^\s:]+)", re.IGNORECASE)
+VIP_RECHAZO_RE = re.compile(r"(?i)cuenta\s+no\s+v[áa]lida")
+VIP_REEMPLAZO_RE = re.compile(r"\[\s*([^\]]+)\s*\]\s*→\s*([^\s:]+)")
+
+# Updates procesados a la vez (usuarios distintos nunca se esperan entre sí)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+BOT_POOL_SIZE = int(os.getenv("BOT_POOL_SIZE", "32"))
+
+# Espera mínima de respuesta de un bot externo (la adaptativa no baja de aquí)
+BOT_TIMEOUT_MIN = float(os.getenv("BOT_TIMEOUT_MIN", "20"))
+
+# Solicitudes por página en /reemplazos
+REEMPLAZOS_PAGINA = int(os.getenv("REEMPLAZOS_PAGINA", "10"))
+
+# Entidades de Telethon resueltas (bots externos, VIP): pocas, pero acotadas
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "256"))
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "86400"))
+
+# Filas por petición en importaciones / asignaciones masivas
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "500"))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+db.init(SUPABASE_URL, SUPABASE_KEY)
 client = TelegramClient("forwarder", API_ID, API_HASH)
 app = None
+avisos = difusion.Difusion(db.admin_ids)
 
 
-_entity_cache = {}
-_last_cmd_by_user = {}
-_ADMIN_CLIENT_COL_CACHE = None   # (no se usa ya para listar clientes; se conserva para /miusuario)
-_admins_cache_ts = 0
-_admins_cache_ids = set()
+_entity_cache = TTLCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)   # @usuario -> entidad de Telethon
+_background: list[asyncio.Task] = []
 
 
 
@@ -92,205 +127,122 @@ async def say_err(update: Update, text_html: str):
 
 
 
-def upsert_usuario(telegram_id: str, username: str, rol: str | None = None):
-    data = {"telegram_id": str(telegram_id), "username": username}
-    if rol is not None:
-        data["rol"] = rol
-    supabase.table("usuarios").upsert(data).execute()
-
-def get_role(telegram_id: str) -> str:
-    try:
-        r = supabase.table("usuarios").select("rol").eq("telegram_id", str(telegram_id)).execute()
-        if r.data:
-            return r.data[0].get("rol", "user") or "user"
-    except Exception:
-        pass
-    return "user"
-
-def ensure_owner_and_seed_admins():
-    upsert_usuario(OWNER_ID, "owner", rol="owner")
+async def ensure_owner_and_seed_admins():
+    await upsert_usuario(OWNER_ID, "owner", rol="owner")
     for aid in SEED_ADMIN_IDS:
-        if get_role(aid) != "owner":
-            upsert_usuario(aid, f"admin_{aid}", rol="admin")
-
-def is_admin_or_owner(uid: str) -> bool:
-    return get_role(uid) in ("admin", "owner")
-
-# (se mantiene para /miusuario, pero ya NO se usa para listar clientes)
-def _detect_admin_client_col() -> str:
-    global _ADMIN_CLIENT_COL_CACHE
-    if _ADMIN_CLIENT_COL_CACHE:
-        return _ADMIN_CLIENT_COL_CACHE
-    for col in ["cliente_id", "cliente", "user_id", "clienteId", "client_id"]:
-        try:
-            supabase.table("admin_clientes").select(col).limit(1).execute()
-            _ADMIN_CLIENT_COL_CACHE = col
-            return col
-        except Exception:
-            continue
-    _ADMIN_CLIENT_COL_CACHE = "cliente_id"
-    return _ADMIN_CLIENT_COL_CACHE
-
-
-def admin_client_ids(admin_id: str) -> set[str]:
-    ids = set()
-    for col in ["cliente_id", "cliente", "user_id", "clienteId", "client_id"]:
-        try:
-            r = supabase.table("admin_clientes").select(col).eq("admin_id", str(admin_id)).execute()
-            ids |= {str(x.get(col)) for x in (r.data or []) if x.get(col)}
-        except Exception:
-            continue
-    return ids
-
-def admin_has_clients(admin_id: str) -> bool:
-    return bool(admin_client_ids(admin_id))
-
-def try_upsert_admin_cliente(admin_id: str, cliente_id: str) -> str:
-    errs = []
-    for col in ["cliente_id", "cliente", "user_id", "clienteId", "client_id"]:
-        try:
-            supabase.table("admin_clientes").upsert({"admin_id": str(admin_id), col: str(cliente_id)}).execute()
-            global _ADMIN_CLIENT_COL_CACHE
-            _ADMIN_CLIENT_COL_CACHE = col
-            return col
-        except Exception as e:
-            errs.append(f"{col}: {e}")
-    raise RuntimeError("No pude escribir en admin_clientes. Revisa columnas. " + " | ".join(errs))
-
-def correo_asignado_a_usuario(uid: str, correo: str) -> bool:
-    r = supabase.table("asignaciones").select("id").eq("usuario_id", uid).eq("correo", correo).eq("activo", True).execute()
-    return bool(r.data)
-
-def buscar_duenho_por_correo_activo(correo: str):
-    r = supabase.table("asignaciones").select("usuario_id, fecha_venc").eq("correo", correo).eq("activo", True).execute()
-    return r.data[0] if r.data else None
-
-def obtener_asignacion_activa(uid: str, correo: str):
-    r = supabase.table("asignaciones").select("*").eq("usuario_id", uid).eq("correo", correo).eq("activo", True).execute()
-    return r.data[0] if r.data else None
-
-def listar_asignaciones_usuario(uid: str):
-    r = supabase.table("asignaciones").select("correo, fecha_venc").eq("usuario_id", uid).eq("activo", True).order("correo").execute()
-    return r.data or []
-
-def listar_todas_asignaciones_activas():
-    r = supabase.table("asignaciones").select("usuario_id, correo, fecha_venc").eq("activo", True).order("usuario_id").execute()
-    return r.data or []
+        if await get_role(aid) != "owner":
+            await upsert_usuario(aid, f"admin_{aid}", rol="admin")
 
-def get_creditos(uid: str) -> int:
-    r = supabase.table("usuarios").select("creditos").eq("telegram_id", str(uid)).execute()
-    if not r.data: return 0
-    try:
-        return int(r.data[0].get("creditos", 0))
-    except Exception:
-        return 0
-
-def set_creditos(uid: str, val: int):
-    if val < 0: val = 0
-    supabase.table("usuarios").update({"creditos": int(val)}).eq("telegram_id", str(uid)).execute()
-
-def recalc_cuentas_asignadas(uid: str) -> int:
-    r = supabase.table("asignaciones").select("id", count="exact").eq("usuario_id", str(uid)).eq("activo", True).execute()
-    total = getattr(r, "count", None) or 0
-    supabase.table("usuarios").update({"cuentas_asignadas": total}).eq("telegram_id", str(uid)).execute()
-    return total
-
-def user_has_blocking_action(uid: str) -> bool:
-    try:
-        r = supabase.table("operaciones").select("id").eq("usuario_id", uid).eq("estado", "pendiente").execute()
-        return bool(r.data)
-    except Exception:
-        return False
-
-def start_operation(uid: str, tipo: str, correo: str | None, payload: str | None):
-    try:
-        data = {
-            "usuario_id": uid,
-            "tipo": tipo,
-            "payload": json.dumps({"correo": correo, "raw": payload}) if (correo or payload) else None,
-            "estado": "pendiente",
-        }
-        ret = supabase.table("operaciones").insert(data).execute()
-        return ret.data[0] if ret.data else {"id": -1}
-    except Exception as e:
-        log.warning(f"start_operation error: {e}")
-        return {"id": -1}
-
-def finish_operation(op_id: int, estado: str, raw_resp: str | None = None):
-    if op_id in (None, -1):
-        return
-    try:
-        data = {"estado": estado}
-        if raw_resp is not None:
-            data["raw_resp"] = raw_resp
-        supabase.table("operaciones").update(data).eq("id", op_id).execute()
-    except Exception as e:
-        log.warning(f"finish_operation error: {e}")
+async def is_admin_or_owner(uid: str) -> bool:
+    return await get_role(uid) in ("admin", "owner")
 
 
 
 async def get_entity_cached(username: str):
-    if username not in _entity_cache:
-        _entity_cache[username] = await client.get_entity(username)
-    return _entity_cache[username]
-
-async def send_and_wait_reply(username: str, text: str, timeout_sec: int = WAIT_TIMEOUT) -> str | None:
+    entity = _entity_cache.get(username)
+    if entity is None:
+        entity = await client.get_entity(username)
+        _entity_cache.set(username, entity)
+    return entity
+
+# Todo envío al bot externo pasa por su cola (ritmo, FloodWait, equidad entre usuarios)
+async def send_to_bot(username: str, text: str, uid: str, prioritario: bool = False):
     entity = await get_entity_cached(username)
-    loop = asyncio.get_event_loop()
-    fut: asyncio.Future = loop.create_future()
-
-    async def _on_reply(event):
-        if not fut.done():
-            fut.set_result(event.message.message or "")
-
-    handler = events.NewMessage(chats=entity)
-    client.add_event_handler(_on_reply, handler)
+    return await outbound.scheduler(client, entity, username).submit(uid, text, prioritario)
+
+# Errores que escapan de los handlers: con una dependencia caída se avisa al usuario, el resto se registra
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    err = context.error
+    if isinstance(err, health.CircuitoAbierto):
+        msg = update.effective_message if isinstance(update, Update) else None
+        if msg is not None:
+            try: await msg.reply_text(f"⛔ {err.nombre} no está disponible. Intenta de nuevo en unos minutos.")
+            except Exception: pass
+        return
+    log.error(f"Error no controlado: {err}", exc_info=err)
+
+def salud_bot(username: str) -> health.Salud:
+    return health.de(username, BOT_TIMEOUT_MIN, WAIT_TIMEOUT)
+
+async def avisar_no_disponible(update: Update, nombre: str):
+    await say_err(update, f"{nombre} no responde en este momento. Intenta de nuevo en unos minutos.")
+
+# La respuesta se correlaciona por correo (o por comando) en el despachador del bot destino.
+# timeout_sec acota cola + respuesta; la respuesta en sí se espera lo que marque la salud del
+# bot (p99 reciente). Con el circuito abierto lanza health.CircuitoAbierto sin enviar nada.
+async def send_and_wait_reply(username: str, text: str, timeout_sec: int = WAIT_TIMEOUT, correo: str | None = None,
+                              uid: str = "", prioritario: bool = False, acepta=None) -> str | None:
+    salud = salud_bot(username)
+    prueba = salud.permitir()
+    router = waiter = None
     try:
-        await client.send_message(entity, text)
+        entity = await get_entity_cached(username)
+        if correo is None:
+            m = outbound.EMAIL_RE.search(text)
+            correo = m.group(0).lower() if m else None
+        router = outbound.router(entity.id, username)
+        waiter = router.expect(correo, text.split()[0], acepta)
+        limite = asyncio.get_running_loop().time() + timeout_sec
+        try:
+            msg = await asyncio.wait_for(send_to_bot(username, text, uid, prioritario), timeout=timeout_sec)
+        except asyncio.TimeoutError:
+            return None          # se agotó esperando en nuestra cola: no es culpa del bot
+        except outbound.ColaLlena:
+            raise
+        except Exception:
+            salud.fallo()
+            raise
+        router.enviado(waiter, msg.id)
+        t0 = asyncio.get_running_loop().time()
         try:
-            return await asyncio.wait_for(fut, timeout=timeout_sec)
+            reply = await asyncio.wait_for(waiter.fut, timeout=max(1.0, min(salud.timeout(), limite - t0)))
         except asyncio.TimeoutError:
+            salud.fallo()
             return None
+        salud.exito(asyncio.get_running_loop().time() - t0)
+        return reply
     finally:
-        client.remove_event_handler(_on_reply, handler)
+        if prueba: salud.soltar()
+        if waiter is not None: router.discard(waiter)
 
-def enforce_user_cooldown(update: Update) -> bool:
+# Límite por usuario y clase de comando (admin/owner exentos; el rol sale de la caché)
+async def enforce_user_cooldown(update: Update, clase: str = "externo") -> bool:
     uid = str(update.effective_user.id)
-    if is_admin_or_owner(uid):
+    espera = ratelimit.tomar(uid, await get_role(uid), clase)
+    if espera <= 0:
         return True
-    now = time.time()
-    last = _last_cmd_by_user.get(uid, 0)
-    if now - last < COOLDOWN_SECONDS:
-        left = COOLDOWN_SECONDS - (now - last)
-        try:
-            asyncio.create_task(update.message.reply_text(f"⏳ Espera {left:.1f}s antes de usar otro comando."))
-        except Exception:
-            pass
-        return False
-    _last_cmd_by_user[uid] = now
-    return True
+    try:
+        asyncio.create_task(update.message.reply_text(f"⏳ Espera {espera:.1f}s antes de usar otro comando."))
+    except Exception:
+        pass
+    return False
 
-async def send_txt_document(context: ContextTypes.DEFAULT_TYPE, chat_id: int, filename: str, header: str, rows: list[str], caption: str):
-    path = tempfile.NamedTemporaryFile(delete=False, suffix=".txt").name
+# Documento armado en memoria a medida que llegan las filas; devuelve cuántas filas tenía (0 = no se envía)
+async def send_rows_document(context: ContextTypes.DEFAULT_TYPE, chat_id: int, base: str, header: list[str], rows,
+                             caption: str, fmt: str = "txt", comprimir: bool = False) -> int:
+    buf, n, comprimido = await build_export(rows, header, fmt, comprimir)
     try:
-        with open(path, "w", encoding="utf-8", newline="\n") as f:
-            if header: f.write(header.rstrip() + "\n")
-            for line in rows: f.write(line.rstrip() + "\n")
-        with open(path, "rb") as fh:
-            await context.bot.send_document(chat_id=chat_id, document=InputFile(fh, filename=filename), caption=caption)
+        if n:
+            await context.bot.send_document(chat_id=chat_id, document=InputFile(buf, filename=export_filename(base, fmt, comprimido)), caption=caption)
     finally:
-        try: os.remove(path)
-        except Exception: pass
+        buf.close()
+    return n
+
+# /cuentas [csv] [gz]
+def _export_opts(args) -> tuple[str, bool]:
+    opts = {a.lower().lstrip(".") for a in (args or [])}
+    return ("csv" if "csv" in opts else "txt"), bool(opts & {"gz", "gzip"})
 
 def fmt_fecha_show(iso_date: str | None) -> str:
     if not iso_date: return "-"
     try: return datetime.fromisoformat(str(iso_date)).strftime("%d/%m/%Y")
     except Exception: return str(iso_date)
 
-def build_info_text(uid: str, username: str) -> str:
-    creditos = get_creditos(uid)
-    total = recalc_cuentas_asignadas(uid)
-    role = get_role(uid)
+async def build_info_text(uid: str, username: str) -> str:
+    row = await db.get_usuario(uid, "rol, creditos, cuentas_asignadas") or {}
+    role = row.get("rol") or "user"
+    creditos = int(row.get("creditos") or 0)
+    total = int(row.get("cuentas_asignadas") or 0)
     return (
         "ℹ️ <b>INFO</b>\n"
         f"{fmt_kv(Username=username or '-', ID=uid, Rol=role, **{'Cuentas': total, 'Créditos': creditos})}"
@@ -315,21 +267,15 @@ def parse_date_str(s: str) -> str | None:
                 return None
     return None
 
-def _date_key(iso_date: str | None):
-    try:
-        return datetime.fromisoformat(str(iso_date)).date()
-    except Exception:
-        return datetime.max.date()
-
 async def must_have_correo(update: Update, correo: str) -> bool:
     correo = (correo or "").strip().lower()
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
 
     if role in ("admin", "owner"):
         return True
 
-    if correo_asignado_a_usuario(uid, correo):
+    if await correo_asignado_a_usuario(uid, correo):
         return True
 
     await say_err(update, "Ese correo no está asignado a tu usuario.")
@@ -339,29 +285,27 @@ async def must_have_correo(update: Update, correo: str) -> bool:
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     username = update.effective_user.username or f"user_{uid}"
-    ensure_owner_and_seed_admins()
     try:
-        r = supabase.table("usuarios").select("telegram_id").eq("telegram_id", uid).execute()
-        if not r.data:
-            upsert_usuario(uid, username, rol=None)
+        if not await db.get_usuario(uid, "telegram_id"):
+            await upsert_usuario(uid, username, rol=None)
             await say_ok(update, "Registro completado.")
     except Exception as e:
         log.warning(f"/start upsert error: {e}")
-    await update.message.reply_text(build_info_text(uid, username), parse_mode=ParseMode.HTML)
+    await update.message.reply_text(await build_info_text(uid, username), parse_mode=ParseMode.HTML)
 
 async def cmd_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     username = update.effective_user.username or f"user_{uid}"
-    await update.message.reply_text(build_info_text(uid, username), parse_mode=ParseMode.HTML)
+    await update.message.reply_text(await build_info_text(uid, username), parse_mode=ParseMode.HTML)
 
 async def cmd_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     user_txt = (
         "📋 <b>Comandos de usuario</b>\n"
         f"{pill('/start')} – registrarte / ver info\n"
         f"{pill('/info')} – tu info\n"
-        f"{pill('/cuentas')} – ver tus cuentas (si >10, en .txt)\n"
+        f"{pill('/cuentas')} – ver tus cuentas (si >10, en .txt; opcional {pill('csv')} {pill('gz')})\n"
         f"{pill('/code')} {pill('<correo>')}\n"
         f"{pill('/link')} {pill('<correo>')}\n"
         f"{pill('/activarTV')} {pill('<correo>')}\n"
@@ -378,66 +322,67 @@ async def cmd_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{pill('/registrarcorreos')}  (texto o .txt:  correo;dd/mm/aaaa)\n"
         f"{pill('/asignar')} {pill('<correo> <dd/mm/aaaa> <ID>')}  (o .txt con caption '/asignar <ID>')\n"
         f"{pill('/remover')} {pill('<correo> <ID>')}               (o .txt con caption '/remover <ID>')\n"
-        f"{pill('/asignarcreditos')} {pill('<cantidad> <ID>')}\n"
+        f"{pill('/asignarcreditos')} {pill('<cantidad> <ID|id1,id2|clientes>')}\n"
         f"{pill('/comprar')} N  (admin/owner)\n"
         f"{pill('/reemplazarvip')} {pill('<correo> <motivo>')}\n"
         f"{pill('/reemplazos')}  (ver pendientes)\n"
+        f"{pill('/estado')}  (colas hacia bots externos, solo owner)\n"
     )
     await update.message.reply_text(user_txt + (admin_txt if role in ("admin","owner") else ""), parse_mode=ParseMode.HTML)
 
 async def cmd_cuentas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
+
+    fmt, gz = _export_opts(context.args)
 
     if role == "owner":
-        filas = listar_todas_asignaciones_activas()
-        if not filas:
-            await say_warn(update, "No hay asignaciones activas.")
-            return
-        filas.sort(key=lambda r: _date_key(r.get("fecha_venc")))
-        rows = [f"{r.get('usuario_id','')} | {r.get('correo','')} | {fmt_fecha_show(r.get('fecha_venc'))}" for r in filas]
-        await send_txt_document(
+        n = await send_rows_document(
             context, update.effective_chat.id,
-            "todas_asignaciones_activas.txt",
-            "usuario_id | correo | fecha_venc (dd/mm/aaaa)",
-            rows,
-            "📄 Todas las cuentas activas (ordenadas por vencimiento)"
+            "todas_asignaciones_activas",
+            ["usuario_id", "correo", "fecha_venc (dd/mm/aaaa)"],
+            ((r.get('usuario_id',''), r.get('correo',''), fmt_fecha_show(r.get('fecha_venc')))
+             async for r in db.iter_asignaciones_activas()),
+            "📄 Todas las cuentas activas (ordenadas por vencimiento)",
+            fmt, gz
         )
+        if not n:
+            await say_warn(update, "No hay asignaciones activas.")
         return
 
     if role == "admin":
-        ids = admin_client_ids(uid) | {uid}
-        rows_all = []
-        for cid in ids:
-            asign = listar_asignaciones_usuario(cid)
-            asign.sort(key=lambda r: _date_key(r.get("fecha_venc")))
-            for r in asign:
-                rows_all.append(f"{cid} | {r['correo']} | {fmt_fecha_show(r.get('fecha_venc'))}")
-        if not rows_all:
-            await say_warn(update, "No hay cuentas para ti o tus clientes.")
-            return
-        await send_txt_document(
+        n = await send_rows_document(
             context, update.effective_chat.id,
-            "cuentas_admin_y_clientes.txt",
-            "usuario_id | correo | fecha_venc (dd/mm/aaaa)",
-            rows_all,
-            "📄 Cuentas (tú y tus clientes) — ordenadas por vencimiento"
+            "cuentas_admin_y_clientes",
+            ["usuario_id", "correo", "fecha_venc (dd/mm/aaaa)"],
+            ((r['usuario_id'], r['correo'], fmt_fecha_show(r.get('fecha_venc')))
+             async for r in db.iter_asignaciones_admin(uid)),
+            "📄 Cuentas (tú y tus clientes) — ordenadas por vencimiento",
+            fmt, gz
         )
+        if not n:
+            await say_warn(update, "No hay cuentas para ti o tus clientes.")
         return
 
-    filas = listar_asignaciones_usuario(uid)
+    it = db.iter_asignaciones_activas(uid)
+    filas = []
+    async for r in it:
+        filas.append(r)
+        if len(filas) > 10: break
     if not filas:
         await say_warn(update, "No tienes cuentas asignadas.")
         return
-    filas.sort(key=lambda r: _date_key(r.get("fecha_venc")))
-    if len(filas) > 10:
-        rows = [f"{r['correo']} | {fmt_fecha_show(r.get('fecha_venc'))}" for r in filas]
-        await send_txt_document(
+    if len(filas) > 10 or context.args:
+        async def _todas():
+            for r in filas: yield r
+            async for r in it: yield r
+        await send_rows_document(
             context, update.effective_chat.id,
-            "tus_cuentas.txt",
-            "correo | fecha_venc (dd/mm/aaaa)",
-            rows,
-            "📄 Tus cuentas (ordenadas por vencimiento)"
+            "tus_cuentas",
+            ["correo", "fecha_venc (dd/mm/aaaa)"],
+            ((r['correo'], fmt_fecha_show(r.get('fecha_venc'))) async for r in _todas()),
+            "📄 Tus cuentas (ordenadas por vencimiento)",
+            fmt, gz
         )
     else:
         lines = "\n".join(f"• {esc(r['correo'])} — vence {esc(fmt_fecha_show(r.get('fecha_venc')))}" for r in filas)
@@ -446,10 +391,11 @@ async def cmd_cuentas(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def forward_simple(update: Update, context: ContextTypes.DEFAULT_TYPE, target_bot: str, cmd_name: str):
-    if not enforce_user_cooldown(update): return
+    if not await enforce_user_cooldown(update): return
     uid = str(update.effective_user.id)
+    privilegiado = await is_admin_or_owner(uid)
 
-    if not is_admin_or_owner(uid) and user_has_blocking_action(uid):
+    if not privilegiado and operaciones.ocupado(uid):
         await say_err(update, "Tienes una acción pendiente. Espera a que finalice.")
         return
 
@@ -465,16 +411,33 @@ async def forward_simple(update: Update, context: ContextTypes.DEFAULT_TYPE, tar
     if cmd_name == "/estoydeviaje":
         send_text = f"/code {correo}"
 
-    op = start_operation(uid, "reenvio", correo, send_text)
+    if not salud_bot(target_bot).disponible():
+        await avisar_no_disponible(update, target_bot); return
+
+    op = operaciones.iniciar(uid, "reenvio", correo, send_text)
+    release_lane()
     await update.message.reply_text("📨 <i>Enviando…</i>", parse_mode=ParseMode.HTML)
 
-    reply = await send_and_wait_reply(target_bot, send_text, timeout_sec=WAIT_TIMEOUT)
+    try:
+        # Misma consulta de otro usuario en curso → se comparte su envío y su respuesta
+        reply = await outbound.vuelos.do(
+            (target_bot, send_text.split()[0], correo),
+            lambda: send_and_wait_reply(target_bot, send_text, timeout_sec=WAIT_TIMEOUT, uid=uid, prioritario=privilegiado),
+        )
+    except outbound.ColaLlena:
+        operaciones.terminar(op, "fallido", raw_resp="cola llena")
+        await say_warn(update, "Hay demasiadas solicitudes en cola. Intenta de nuevo en unos minutos.")
+        return
+    except health.CircuitoAbierto as e:
+        operaciones.terminar(op, "fallido", raw_resp="circuito abierto")
+        await avisar_no_disponible(update, e.nombre)
+        return
     if reply is None:
-        finish_operation(op["id"], "fallido", raw_resp="timeout")
-        await say_warn(update, "El bot externo no respondió a tiempo (5 min).")
+        operaciones.terminar(op, "fallido", raw_resp="timeout")
+        await say_warn(update, "El bot externo no respondió a tiempo.")
         return
 
-    finish_operation(op["id"], "completado", raw_resp=reply)
+    operaciones.terminar(op, "completado", raw_resp=reply)
     await update.message.reply_text(f"📬 <b>Respuesta</b>:\n{esc(reply)}", parse_mode=ParseMode.HTML)
 
 async def cmd_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -493,9 +456,9 @@ async def cmd_estoydeviaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await forward_simple(update, context, CODIGOS_NETFLIX, "/estoydeviaje")
 
 async def cmd_comprar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not enforce_user_cooldown(update): return
+    if not await enforce_user_cooldown(update): return
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
 
     if not context.args:
         await say_warn(update, "Uso (usuario): /comprar 1\nUso (admin/owner): /comprar N")
@@ -512,50 +475,91 @@ async def cmd_comprar(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await say_warn(update, "Uso: /comprar 1")
             return
 
-    if not is_admin_or_owner(uid) and user_has_blocking_action(uid):
+    if role not in ("admin", "owner") and operaciones.ocupado(uid):
         await say_err(update, "Tienes una acción pendiente. Espera a que finalice.")
         return
 
-    creditos = get_creditos(uid)
-    if creditos < cantidad:
-        await say_err(update, f"Créditos insuficientes. Tienes {creditos}, necesitas {cantidad}.")
-        return
+    if not salud_bot(SERVICIO_VIP).disponible():
+        await avisar_no_disponible(update, SERVICIO_VIP); return
 
-    op = start_operation(uid, "compra" if cantidad == 1 else "compra_lote", None, f"/comprar {cantidad}")
-    await update.message.reply_text(f"🛒 <b>Procesando</b> {cantidad} compra(s)… (máx 5 min c/u)", parse_mode=ParseMode.HTML)
+    # Los N créditos se reservan de una vez; lo que no se use se devuelve al final
+    try:
+        reserva = await db.reservar_creditos(uid, cantidad)
+    except Exception as e:
+        await say_err(update, f"No se pudieron reservar créditos: {esc(e)}")
+        return
+    if reserva.get("error"):
+        await say_err(update, f"Créditos insuficientes. Tienes {reserva.get('saldo', 0)}, necesitas {cantidad}.")
+        return
 
-    exitos, fallos = [], []
+    op = operaciones.iniciar(uid, "compra" if cantidad == 1 else "compra_lote", None, f"/comprar {cantidad}")
+    exitos, fallos = [], []          # (n.º de compra, texto)
+    liquidaciones = []
 
-    for i in range(cantidad):
-        reply_text = await send_and_wait_reply(SERVICIO_VIP, "/comprar 1", timeout_sec=WAIT_TIMEOUT)
-        if reply_text is None:
-            fallos.append(f"#{i+1}: sin respuesta"); continue
-        m = re.search(r"Cuenta:\s*([^\s:@]+@[^\s:]+)", reply_text, flags=re.IGNORECASE)
-        if not m:
-            fallos.append(f"#{i+1}: respuesta inválida"); continue
-        correo = m.group(1).lower().strip()
+    async def liquidar(i: int, correo: str):
+        try:
+            res = await db.liquidar_compra(uid, correo, cobrar=False)
+            if res.get("error"):
+                fallos.append((i, f"#{i+1}: correo ya asignado a otro")); return
+            exitos.append((i, f"{correo} (vence {fmt_fecha_show(res['fecha_venc'])})"))
+        except Exception as e:
+            fallos.append((i, f"#{i+1}: error DB {e}"))
 
-        dueno = buscar_duenho_por_correo_activo(correo)
-        if dueno and dueno["usuario_id"] != uid:
-            fallos.append(f"#{i+1}: correo ya asignado a otro"); continue
+    # Desde aquí los créditos están reservados: pase lo que pase (error, cancelación) se esperan
+    # las liquidaciones lanzadas y se devuelve lo no usado.
+    reembolso = None
+    try:
+        release_lane()
+        estado = await update.message.reply_text(f"🛒 Procesando {cantidad} compra(s)… (máx 5 min c/u)")
 
-        try:
-            venc = (datetime.utcnow().date() + timedelta(days=30)).isoformat()
-            supabase.table("correos").upsert({"correo": correo, "vencimiento": venc}, on_conflict="correo").execute()
-            if obtener_asignacion_activa(uid, correo):
-                supabase.table("asignaciones").update({"fecha_venc": venc}).eq("usuario_id", uid).eq("correo", correo).eq("activo", True).execute()
+        # La liquidación de la compra i corre en segundo plano mientras se pide la i+1
+        for i in range(cantidad):
+            try:
+                reply_text = await send_and_wait_reply(SERVICIO_VIP, "/comprar 1", timeout_sec=WAIT_TIMEOUT,
+                                                       uid=uid, prioritario=role in ("admin", "owner"), acepta=CUENTA_RE.search)
+            except outbound.ColaLlena:
+                fallos.append((i, f"#{i+1}: cola del bot externo llena")); break
+            except health.CircuitoAbierto:
+                fallos.append((i, f"#{i+1}: {SERVICIO_VIP} no responde; se detuvo el lote")); break
+            except Exception as e:
+                fallos.append((i, f"#{i+1}: error al enviar a {SERVICIO_VIP} ({e}); se detuvo el lote")); break
+            if reply_text is None:
+                fallos.append((i, f"#{i+1}: sin respuesta"))
+            elif not (m := CUENTA_RE.search(reply_text)):
+                fallos.append((i, f"#{i+1}: respuesta inválida"))
             else:
-                supabase.table("asignaciones").insert({"correo": correo, "usuario_id": uid, "fecha_venc": venc, "asignado_por": "servicio_vip", "activo": True}).execute()
-            set_creditos(uid, get_creditos(uid) - 1)
+                correo = m.group(1).lower().strip()
+                try:
+                    dueno = await buscar_duenho_por_correo_activo(correo)
+                except Exception:
+                    dueno = None     # liquidar_compra vuelve a comprobarlo en la base
+                if dueno and dueno["usuario_id"] != uid:
+                    fallos.append((i, f"#{i+1}: correo ya asignado a otro"))
+                else:
+                    liquidaciones.append(asyncio.create_task(liquidar(i, correo)))
+            if cantidad > 1:
+                await _edit_progress(estado, f"🛒 Compras: {i+1}/{cantidad} · pedidas {len(liquidaciones)} · fallos {len(fallos)}")
+    finally:
+        await asyncio.shield(asyncio.gather(*liquidaciones))
+        sobrantes = cantidad - len(exitos)
+        if sobrantes:
             try:
-                supabase.table("creditos_historial").insert({"usuario_id": uid, "delta": -1, "motivo": "compra", "hecho_por": "servicio_vip"}).execute()
-            except Exception: pass
-            recalc_cuentas_asignadas(uid)
-            exitos.append(f"{correo} (vence {fmt_fecha_show(venc)})")
-        except Exception as e:
-            fallos.append(f"#{i+1}: error DB {e}")
+                await asyncio.shield(db.devolver_creditos(uid, sobrantes))
+                reembolso = True
+            except Exception as e:
+                log.error(f"Reembolso de {sobrantes} créditos a {uid} falló: {e}")
+                reembolso = False
+        operaciones.terminar(op, "completado" if exitos else "fallido", raw_resp=f"exitos={len(exitos)}, fallos={len(fallos)}")
+
+    exitos = [t for _, t in sorted(exitos)]
+    fallos = [t for _, t in sorted(fallos)]
+    resumen = f"🛒 Compras: {len(exitos)}/{cantidad} completadas"
+    if reembolso:
+        resumen += f" · {sobrantes} crédito(s) devueltos"
+    elif reembolso is False:
+        fallos.append(f"No se pudieron devolver {sobrantes} crédito(s); avisa a un admin.")
+    await _edit_progress(estado, resumen)
 
-    finish_operation(op["id"], "completado" if exitos else "fallido", raw_resp=f"exitos={len(exitos)}, fallos={len(fallos)}")
     parts = []
     if exitos:
         parts.append("🟢 <b>Exitosas</b>:\n" + "\n".join(f"• {esc(x)}" for x in exitos[:20]) + ("…" if len(exitos) > 20 else ""))
@@ -564,7 +568,7 @@ async def cmd_comprar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("\n\n".join(parts) if parts else "No se concretó ninguna compra.", parse_mode=ParseMode.HTML)
 
 async def cmd_renovar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not enforce_user_cooldown(update): return
+    if not await enforce_user_cooldown(update): return
     uid = str(update.effective_user.id)
 
     if not context.args:
@@ -572,81 +576,63 @@ async def cmd_renovar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     correo = context.args[0].strip().lower()
-    if not is_admin_or_owner(uid) and user_has_blocking_action(uid):
+    privilegiado = await is_admin_or_owner(uid)
+    if not privilegiado and operaciones.ocupado(uid):
         await say_err(update, "Tienes una acción pendiente. Espera a que finalice.")
         return
     if not await must_have_correo(update, correo):
         return
 
-    if get_creditos(uid) < 1:
+    if await get_creditos(uid) < 1:
         await say_err(update, "No tienes créditos suficientes.")
         return
+    if not salud_bot(SERVICIO_VIP).disponible():
+        await avisar_no_disponible(update, SERVICIO_VIP); return
 
-    op = start_operation(uid, "renovar", correo, f"/renovar {correo}")
+    op = operaciones.iniciar(uid, "renovar", correo, f"/renovar {correo}")
+    release_lane()
     await update.message.reply_text("🔄 <i>Solicitando renovación…</i>", parse_mode=ParseMode.HTML)
 
-    reply = await send_and_wait_reply(SERVICIO_VIP, f"/renovar {correo}", timeout_sec=WAIT_TIMEOUT)
+    try:
+        reply = await send_and_wait_reply(SERVICIO_VIP, f"/renovar {correo}", timeout_sec=WAIT_TIMEOUT, uid=uid,
+                                          prioritario=privilegiado, acepta=lambda t: correo in t.lower())
+    except outbound.ColaLlena:
+        operaciones.terminar(op, "fallido", raw_resp="cola llena")
+        await say_warn(update, "Hay demasiadas solicitudes en cola. Intenta de nuevo en unos minutos.")
+        return
+    except health.CircuitoAbierto as e:
+        operaciones.terminar(op, "fallido", raw_resp="circuito abierto")
+        await avisar_no_disponible(update, e.nombre)
+        return
     if reply is None:
-        finish_operation(op["id"], "fallido", raw_resp="timeout")
-        await say_warn(update, "El bot externo no respondió a tiempo (5 min).")
+        operaciones.terminar(op, "fallido", raw_resp="timeout")
+        await say_warn(update, "El bot externo no respondió a tiempo.")
         return
 
     if correo not in reply:
-        finish_operation(op["id"], "fallido", raw_resp="correo no coincide")
+        operaciones.terminar(op, "fallido", raw_resp="correo no coincide")
         await say_err(update, "La respuesta no coincide con el correo solicitado.")
         return
 
-    # === NUEVO CÁLCULO DE VENCIMIENTO ===
-    hoy = datetime.utcnow().date()
-    base = hoy
+    # Vencimiento nuevo = max(hoy, vencimiento actual) + 30 días; se calcula y liquida en la base
     try:
-        asig = obtener_asignacion_activa(uid, correo)
-        if asig and asig.get("fecha_venc"):
-            venc_actual = datetime.fromisoformat(str(asig["fecha_venc"])).date()
-            # Extender desde la mayor entre hoy y la fecha actual:
-            base = max(venc_actual, hoy)
-    except Exception:
-        pass
-
-    nueva = (base + timedelta(days=30)).isoformat()
-    # =====================================
-
-    try:
-        # upsert en correos
-        supabase.table("correos").upsert(
-            {"correo": correo, "vencimiento": nueva}, on_conflict="correo"
-        ).execute()
-
-        # actualizar o insertar asignación activa
-        if not obtener_asignacion_activa(uid, correo):
-            supabase.table("asignaciones").insert({
-                "correo": correo, "usuario_id": uid, "fecha_venc": nueva,
-                "asignado_por": "renovacion", "activo": True
-            }).execute()
-        else:
-            supabase.table("asignaciones").update({"fecha_venc": nueva}) \
-                .eq("usuario_id", uid).eq("correo", correo).eq("activo", True).execute()
-
-        # descontar crédito y registrar hist.
-        set_creditos(uid, get_creditos(uid) - 1)
-        try:
-            supabase.table("creditos_historial").insert({
-                "usuario_id": uid, "delta": -1, "motivo": "renovacion", "hecho_por": "servicio_vip"
-            }).execute()
-        except Exception:
-            pass
-
-        recalc_cuentas_asignadas(uid)
-        finish_operation(op["id"], "completado", raw_resp=reply)
-        await say_ok(update, f"Account Update [{esc(correo)}]: {esc(fmt_fecha_show(nueva))}")
+        res = await db.liquidar_renovacion(uid, correo)
+        if res.get("error") == "saldo_insuficiente":
+            # El saldo se gastó mientras el VIP respondía (otra renovación, una transferencia…)
+            operaciones.terminar(op, "fallido", raw_resp=f"saldo insuficiente al liquidar: {reply}")
+            await say_err(update, "No tienes créditos suficientes; la renovación no se registró.")
+            notify_admins(f"⚠️ Renovación de <code>{esc(correo)}</code> hecha en el VIP sin saldo de {esc(uid)}; no se registró.")
+            return
+        operaciones.terminar(op, "completado", raw_resp=reply)
+        await say_ok(update, f"Account Update [{esc(correo)}]: {esc(fmt_fecha_show(res['fecha_venc']))}")
     except Exception as e:
-        finish_operation(op["id"], "fallido", raw_resp=str(e))
+        operaciones.terminar(op, "fallido", raw_resp=str(e))
         await say_err(update, f"Error al actualizar: {esc(e)}")
 
 
 async def cmd_miusuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if get_role(uid) != "admin":
+    if await get_role(uid) != "admin":
         await say_err(update, "Solo admins pueden usar /miusuario.")
         return
 
@@ -663,8 +649,8 @@ async def cmd_miusuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        upsert_usuario(cliente, f"user_{cliente}")
-        col_used = try_upsert_admin_cliente(uid, cliente)
+        await upsert_usuario(cliente, f"user_{cliente}")
+        col_used = await db.upsert_admin_cliente(uid, cliente)
         await update.effective_message.reply_text(
             "✅ Cliente registrado correctamente.\n"
             f"• Admin: {uid}\n"
@@ -685,7 +671,7 @@ async def cmd_misuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Owner: elevar a admin
 async def cmd_registraradmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if get_role(uid) != "owner":
+    if await get_role(uid) != "owner":
         await say_err(update, "Solo el owner puede usar /registraradmin.")
         return
 
@@ -698,20 +684,55 @@ async def cmd_registraradmin(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await say_err(update, "ID inválido. Debe ser numérico.")
         return
 
-    upsert_usuario(target, f"admin_{target}", rol="admin")
+    await upsert_usuario(target, f"admin_{target}", rol="admin")
     await say_ok(update, f"{esc(target)} ahora es admin.")
 
+# --- Owner: estado de las colas hacia los bots externos
+async def cmd_estado(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+    if await get_role(uid) != "owner":
+        await say_err(update, "Solo el owner puede usar /estado.")
+        return
+
+    bloques = [fmt_kv(**{
+        "Operaciones en curso": operaciones.activas(), "Auditoría en cola": audit.pendientes(),
+        "Consultas compartidas": outbound.vuelos.compartidas,
+        "Reemplazos esperando al VIP": len(reemplazos.en_curso),
+        "Updates descartados (carril lleno)": lanes.descartados,
+    })]
+    st = avisos.stats()
+    bloques.append("📣 <b>Avisos a admins</b>\n" + fmt_kv(**{
+        "En cola": st["cola"], "Enviados": st["enviados"], "Fallidos": st["fallidos"], "Resúmenes": st["resumenes"],
+    }))
+    for sch in outbound.schedulers():
+        st = sch.stats()
+        bloques.append(f"📤 <b>{esc(sch.name)}</b>\n" + fmt_kv(**{
+            "En cola": st["cola"], "Enviados": st["enviados"],
+            "Espera media": f"{st['espera_media']}s", "Espera máx": f"{st['espera_max']}s",
+            "FloodWaits": st["flood_waits"], "Flood restante": f"{st['flood_restante']}s",
+            "Respuestas descartadas": outbound.descartadas(sch.entity.id),
+        }))
+    if not outbound.schedulers():
+        bloques.append("Sin envíos a bots externos todavía.")
+    for sal in health.todas():
+        st = sal.stats()
+        bloques.append(f"🩺 <b>{esc(sal.nombre)}</b>\n" + fmt_kv(**{
+            "Circuito": st["estado"], "p50": st["p50"], "p99": st["p99"], "Timeout": st["timeout"],
+            "Fallos seguidos": st["fallos"], "Rechazadas": st["rechazadas"],
+        }))
+    await update.message.reply_text("\n\n".join(bloques), parse_mode=ParseMode.HTML)
+
 
 
 async def cmd_asignar_creditos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     if role not in ("admin", "owner"):
         await say_err(update, "No autorizado.")
         return
 
     if len(context.args) != 2 or not context.args[0].isdigit():
-        await say_warn(update, f"Uso: {pill('/asignarcreditos')} {pill('<cantidad> <ID>')}")
+        await say_warn(update, f"Uso: {pill('/asignarcreditos')} {pill('<cantidad> <ID|id1,id2|clientes>')}")
         return
 
     cantidad = int(context.args[0])
@@ -719,49 +740,38 @@ async def cmd_asignar_creditos(update: Update, context: ContextTypes.DEFAULT_TYP
         await say_warn(update, "La cantidad debe ser positiva.")
         return
 
-    target = context.args[1].strip()
-    if not target.isdigit():
-        await say_warn(update, "ID destino inválido.")
-        return
+    arg = context.args[1].strip()
+    if arg.lower() == "clientes":
+        destinos = sorted(await admin_client_ids(uid))
+        if not destinos:
+            await say_warn(update, "No tienes clientes registrados.")
+            return
+    else:
+        destinos = [t.strip() for t in arg.split(",") if t.strip()]
+        if not destinos or not all(t.isdigit() for t in destinos):
+            await say_warn(update, "ID destino inválido.")
+            return
 
     try:
-        if role == "admin":
-            saldo_admin = get_creditos(uid)
-            if saldo_admin < cantidad:
-                await say_err(update, f"No tienes suficientes créditos. Tienes {saldo_admin}.")
-                return
-
-        r = supabase.table("usuarios").select("creditos, username").eq("telegram_id", target).execute()
-        if not r.data:
-            upsert_usuario(target, f"user_{target}")
-            actuales = 0
-            username_dest = f"user_{target}"
-        else:
-            actuales = int(r.data[0].get("creditos", 0) or 0)
-            username_dest = r.data[0].get("username") or f"user_{target}"
-
-        if role == "admin":
-            set_creditos(uid, get_creditos(uid) - cantidad)
-            try:
-                supabase.table("creditos_historial").insert({
-                    "usuario_id": uid, "delta": -cantidad, "motivo": "transferencia", "hecho_por": uid
-                }).execute()
-            except Exception: pass
-
-        supabase.table("usuarios").update({"creditos": actuales + cantidad}).eq("telegram_id", target).execute()
-        try:
-            supabase.table("creditos_historial").insert({
-                "usuario_id": target, "delta": cantidad,
-                "motivo": "asignacion_admin" if role == "admin" else "asignacion_owner",
-                "hecho_por": uid
-            }).execute()
-        except Exception: pass
+        # Débito, abonos e historial en una sola transacción (ver sql/002_transferencias.sql)
+        res = await db.transferir_creditos(uid, destinos, cantidad, debitar=(role == "admin"))
+        if res.get("error") == "saldo_insuficiente":
+            await say_err(update, f"No tienes suficientes créditos. Tienes {res['saldo']}, necesitas {cantidad * len(set(destinos) - {uid})}.")
+            return
+        if res.get("error"):
+            await say_warn(update, "Sin destinos válidos.")
+            return
 
-        await update.message.reply_text(
-            "🎁 <b>Créditos asignados</b>\n" +
-            fmt_kv(Destino=f"{username_dest} ({target})", Antes=actuales, Cambio=f"+{cantidad}", Ahora=actuales+cantidad),
-            parse_mode=ParseMode.HTML
-        )
+        dest = res["destinos"]
+        if len(dest) == 1:
+            d = dest[0]
+            cuerpo = fmt_kv(Destino=f"{d['username'] or 'user_' + d['id']} ({d['id']})",
+                            Antes=d["antes"], Cambio=f"+{cantidad}", Ahora=d["ahora"])
+        else:
+            cuerpo = fmt_kv(Destinos=len(dest), Cambio=f"+{cantidad} c/u", Total=f"+{cantidad * len(dest)}")
+        if res.get("origen") is not None:
+            cuerpo += "\n" + fmt_kv(**{"Tu saldo": res["origen"]})
+        await update.message.reply_text("🎁 <b>Créditos asignados</b>\n" + cuerpo, parse_mode=ParseMode.HTML)
     except Exception as e:
         err = str(e)
         ayuda = ""
@@ -771,25 +781,12 @@ async def cmd_asignar_creditos(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 
-async def notify_admins(text: str, keyboard: InlineKeyboardMarkup | None = None):
-    global _admins_cache_ts, _admins_cache_ids, app
-    now = time.time()
-    if now - _admins_cache_ts > 60 or not _admins_cache_ids:
-        ids = set()
-        r = supabase.table("usuarios").select("telegram_id").in_("rol", ["owner", "admin"]).execute()
-        for row in r.data or []:
-            ids.add(str(row["telegram_id"]))
-        _admins_cache_ids = ids
-        _admins_cache_ts = now
-
-    for aid in _admins_cache_ids:
-        try:
-            await app.bot.send_message(chat_id=int(aid), text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception:
-            pass
+# Encola el aviso y vuelve: sale en segundo plano a todos los admins (ver difusion.py)
+def notify_admins(text: str, keyboard: InlineKeyboardMarkup | None = None, **resumen):
+    avisos.publicar(text, keyboard, **resumen)
 
 async def cmd_reemplazar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not enforce_user_cooldown(update): return
+    if not await enforce_user_cooldown(update): return
     uid = str(update.effective_user.id)
     if len(context.args) < 2:
         await say_warn(update, f"Uso: {pill('/reemplazar')} {pill('<correo> <motivo>')}")
@@ -798,102 +795,156 @@ async def cmd_reemplazar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     correo = context.args[0].strip().lower()
     motivo = " ".join(context.args[1:]).strip()
 
-    if not is_admin_or_owner(uid) and user_has_blocking_action(uid):
+    if not await is_admin_or_owner(uid) and operaciones.ocupado(uid):
         await say_err(update, "Tienes una acción pendiente. Espera a que finalice.")
         return
     if not await must_have_correo(update, correo):
         return
 
-    ins = supabase.table("reemplazos_solicitudes").insert({
+    ins = await db.crear_reemplazo({
         "usuario_id": uid, "correo": correo, "motivo": motivo, "estado": "pendiente"
-    }).execute()
-    req_id = ins.data[0]["id"]
+    })
+    req_id = ins["id"]
 
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Aceptar", callback_data=f"reemp_ok:{req_id}"),
                                 InlineKeyboardButton("🛑 Rechazar", callback_data=f"reemp_no:{req_id}")]])
+    usuario = f"{update.effective_user.username or '-'} (ID {uid})"
     text = (
         "🆘 <b>Solicitud de reemplazo</b>\n" +
-        fmt_kv(Correo=correo, Usuario=f"{update.effective_user.username or '-'} (ID {uid})", Motivo=motivo)
+        fmt_kv(Correo=correo, Usuario=usuario, Motivo=motivo)
+    )
+    notify_admins(
+        text, keyboard=kb, grupo="solicitudes", titulo="🆘 <b>Solicitudes de reemplazo</b>",
+        linea=f"#{req_id} {esc(correo)} — {esc(usuario)}: {esc(motivo)}",
+        botones=[InlineKeyboardButton(f"✅ #{req_id}", callback_data=f"reemp_ok:{req_id}"),
+                 InlineKeyboardButton(f"🛑 #{req_id}", callback_data=f"reemp_no:{req_id}")],
     )
-    await notify_admins(text, keyboard=kb)
     await say_ok(update, "Tu solicitud fue enviada a los administradores.")
 
 async def on_reemp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     uid_click = str(query.from_user.id)
-    if not is_admin_or_owner(uid_click):
+    if not await is_admin_or_owner(uid_click):
         await query.answer("No autorizado.", show_alert=True); return
     await query.answer()
 
     data = query.data or ""
     if not data.startswith("reemp_"): return
-    action, req_id_s = data.split(":")
-    req_id = int(req_id_s)
-
-    sel = supabase.table("reemplazos_solicitudes").select("*").eq("id", req_id).execute()
-    if not sel.data:
-        await query.edit_message_text("Solicitud no encontrada (ya gestionada)."); return
-    req = sel.data[0]
+    # reemp_ok:<id> (aviso individual) o reemp_ok:<id>:l:<página> (desde el listado /reemplazos)
+    partes = data.split(":")
+    action, req_id = partes[0], int(partes[1])
+    pagina = int(partes[3]) if len(partes) == 4 and partes[2] == "l" else None
+
+    async def responder(msg: str):
+        if pagina is None:
+            await query.edit_message_text(msg); return
+        text, kb = await pagina_reemplazos(desde=pagina or None)
+        await query.edit_message_text(f"{esc(msg)}\n\n{text}", reply_markup=kb, parse_mode=ParseMode.HTML)
+
+    req = await db.get_reemplazo(req_id)
+    if not req:
+        await responder("Solicitud no encontrada (ya gestionada)."); return
     if req["estado"] != "pendiente":
-        await query.edit_message_text("Solicitud ya gestionada."); return
+        await responder(f"Solicitud #{req_id} ya gestionada."); return
+
+    nuevo_estado = "rechazado" if action == "reemp_no" else "aceptado"
+    if not await db.cambiar_estado_reemplazo(req_id, "pendiente", {"estado": nuevo_estado, "aprobado_por": uid_click}):
+        await responder(f"Solicitud #{req_id} ya gestionada."); return
 
     if action == "reemp_no":
-        supabase.table("reemplazos_solicitudes").update({"estado": "rechazado", "aprobado_por": uid_click}).eq("id", req_id).execute()
-        await query.edit_message_text("❌ Rechazada.")
+        await responder(f"❌ #{req_id} rechazada.")
         try: await context.bot.send_message(chat_id=int(req["usuario_id"]), text=f"❌ Tu reemplazo para {req['correo']} fue rechazado.")
         except Exception: pass
         return
 
-    supabase.table("reemplazos_solicitudes").update({"estado": "aceptado", "aprobado_por": uid_click}).eq("id", req_id).execute()
-    correo = req["correo"]; user_id = req["usuario_id"]
-    try: await context.bot.send_message(chat_id=int(user_id), text="✅ Solicitud aceptada. Buscando…")
+    try: await context.bot.send_message(chat_id=int(req["usuario_id"]), text="✅ Solicitud aceptada. Buscando…")
     except Exception: pass
 
+    if await enviar_reemplazo_vip(req, uid_click):
+        await responder(f"🟢 #{req_id} aceptada y enviada al VIP.")
+    else:
+        await responder(f"⚠️ No se pudo enviar #{req_id} al VIP; volvió a pendiente.")
+
+# /reemplazos: cola de solicitudes pendientes, REEMPLAZOS_PAGINA por página (una consulta por página)
+async def pagina_reemplazos(desde: int | None = None, hasta: int | None = None):
+    rows, mas = await db.pagina_reemplazos_pendientes(desde, hasta, REEMPLAZOS_PAGINA)
+    if not rows:
+        return "No hay solicitudes de reemplazo pendientes.", None
+    primero, ultimo = rows[0]["id"], rows[-1]["id"]
+    hay_prev = mas if hasta is not None else desde is not None
+    hay_next = mas if hasta is None else True
+    clave = primero if hay_prev else 0      # 0 = primera página
+    kb = [[InlineKeyboardButton(f"✅ #{r['id']}", callback_data=f"reemp_ok:{r['id']}:l:{clave}"),
+           InlineKeyboardButton(f"🛑 #{r['id']}", callback_data=f"reemp_no:{r['id']}:l:{clave}")] for r in rows]
+    nav = []
+    if hay_prev: nav.append(InlineKeyboardButton("⬅️ Anteriores", callback_data=f"reemps:h:{primero - 1}"))
+    if hay_next: nav.append(InlineKeyboardButton("Siguientes ➡️", callback_data=f"reemps:d:{ultimo + 1}"))
+    if nav: kb.append(nav)
+    lineas = [f"• <b>#{r['id']}</b> {esc(r['correo'])} — ID {esc(r['usuario_id'])}: {esc(r.get('motivo') or '-')}" for r in rows]
+    return "🆘 <b>Reemplazos pendientes</b>\n" + "\n".join(lineas), InlineKeyboardMarkup(kb)
+
+async def cmd_reemplazos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin_or_owner(str(update.effective_user.id)):
+        await say_err(update, "No autorizado."); return
+    text, kb = await pagina_reemplazos()
+    await update.message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+
+async def on_reemps_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not await is_admin_or_owner(str(query.from_user.id)):
+        await query.answer("No autorizado.", show_alert=True); return
+    await query.answer()
+    _, direccion, cursor = (query.data or "").split(":")
+    if direccion == "h":
+        text, kb = await pagina_reemplazos(hasta=int(cursor))
+    else:
+        text, kb = await pagina_reemplazos(desde=int(cursor))
+    try: await query.edit_message_text(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+    except Exception: pass   # "message is not modified"
+
+# Se registra en la tabla de correlación antes de enviar (la respuesta puede llegar enseguida);
+# si el envío falla, la solicitud vuelve a 'pendiente' para poder aceptarla otra vez.
+async def enviar_reemplazo_vip(req: dict, uid: str) -> bool:
+    reemplazos.en_curso.registrar(req)
     try:
-        await client.send_message(await get_entity_cached(VIP_REEMPLAZARBOT), f"/reemplazar {correo} {req.get('motivo') or ''}".strip())
+        await send_to_bot(VIP_REEMPLAZARBOT, f"/reemplazar {req['correo']} {req.get('motivo') or ''}".strip(), uid, prioritario=True)
+        return True
     except Exception as e:
         log.warning(f"Error enviando al VIP: {e}")
-    await query.edit_message_text("🟢 Aceptada y enviada al VIP.")
+        reemplazos.en_curso.quitar(req["id"])
+        try: await db.actualizar_reemplazo(req["id"], {"estado": "pendiente"})
+        except Exception: pass
+        return False
 
 async def cmd_reemplazarvip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if not is_admin_or_owner(uid):
+    if not await is_admin_or_owner(uid):
         await say_err(update, "No autorizado."); return
     if len(context.args) < 2:
         await say_warn(update, f"Uso: {pill('/reemplazarvip')} {pill('<correo> <motivo>')}")
         return
     correo = context.args[0].strip().lower()
     motivo = " ".join(context.args[1:]).strip()
-    supabase.table("reemplazos_solicitudes").insert({"usuario_id": uid, "correo": correo, "motivo": motivo, "estado": "aceptado", "aprobado_por": uid}).execute()
-    await say_ok(update, "Reemplazo enviado al VIP.")
-    try:
-        await client.send_message(await get_entity_cached(VIP_REEMPLAZARBOT), f"/reemplazar {correo} {motivo}".strip())
-    except Exception as e:
-        log.warning(f"Error enviando al VIP: {e}")
+    req = await db.crear_reemplazo({"usuario_id": uid, "correo": correo, "motivo": motivo, "estado": "aceptado", "aprobado_por": uid})
+    if await enviar_reemplazo_vip(req, uid):
+        await say_ok(update, "Reemplazo enviado al VIP.")
+    else:
+        await say_err(update, "No se pudo enviar al VIP; la solicitud quedó pendiente.")
 
-@client.on(events.NewMessage(chats=None))
-async def on_any_message(event):
+# Solo mensajes entrantes del chat con VIP_REEMPLAZARBOT (filtro por ID, se registra en main)
+async def on_vip_message(event):
     try:
-        sender = await event.get_sender()
-        uname = f"@{sender.username}" if getattr(sender, 'username', None) else ""
-        if uname != VIP_REEMPLAZARBOT:
-            return
-
         text = (event.message.message or "").strip()
 
         # Rechazo del VIP
-        if re.search(r"(?i)cuenta\s+no\s+v[áa]lida", text):
-            rq = supabase.table("reemplazos_solicitudes") \
-                .select("id, usuario_id, correo, estado") \
-                .in_("estado", ["aceptado", "pendiente"]) \
-                .order("id", desc=True).limit(1).execute()
-
-            if rq.data:
-                req = rq.data[0]
+        if VIP_RECHAZO_RE.search(text):
+            req = reemplazos.en_curso.para_rechazo(text)
+
+            if req:
                 uid = req["usuario_id"]
                 correo = req.get("correo")
                 try:
-                    supabase.table("reemplazos_solicitudes").update({"estado": "rechazado"}).eq("id", req["id"]).execute()
+                    await db.actualizar_reemplazo(req["id"], {"estado": "rechazado"})
                 except Exception:
                     pass
                 try:
@@ -904,10 +955,11 @@ async def on_any_message(event):
                     )
                 except Exception:
                     pass
-                await notify_admins(
+                notify_admins(
                     "❌ Reemplazo rechazado por el VIP\n" +
                     fmt_kv(Correo=correo or "-", User_ID=uid, Motivo=text),
-                    keyboard=None
+                    grupo="vip_rechazos", titulo="❌ Reemplazos rechazados por el VIP",
+                    linea=f"• {esc(correo or '-')} (ID {uid})",
                 )
             return
 
@@ -915,41 +967,32 @@ async def on_any_message(event):
         if "Cuenta reemplazada" not in text:
             return
 
-        m = re.search(r"\[\s*([^\]]+)\s*\]\s*→\s*([^\s:]+)", text)
+        m = VIP_REEMPLAZO_RE.search(text)
         if not m:
             return
 
         viejo = m.group(1).strip().lower()
         nuevo = m.group(2).strip().lower()
 
-        rq = supabase.table("reemplazos_solicitudes") \
-            .select("id, usuario_id, correo, estado") \
-            .eq("correo", viejo) \
-            .in_("estado", ["aceptado", "pendiente"]) \
-            .order("id", desc=True).limit(1).execute()
+        req = reemplazos.en_curso.por_correo(viejo)
 
-        if not rq.data:
-            await notify_admins(
+        if not req:
+            notify_admins(
                 "ℹ️ VIP reemplazó (sin solicitud asociada):\n" +
                 fmt_kv(Viejo=viejo, Nuevo=nuevo),
-                keyboard=None
+                grupo="vip_sin_solicitud", titulo="ℹ️ Reemplazos del VIP sin solicitud asociada",
+                linea=f"• {esc(viejo)} → {esc(nuevo)}",
             )
             return
 
-        req = rq.data[0]
         uid = req["usuario_id"]
 
-        old_asig = obtener_asignacion_activa(uid, viejo)
-        fecha_venc = old_asig["fecha_venc"] if old_asig else (datetime.utcnow().date() + timedelta(days=30)).isoformat()
-
-        supabase.table("asignaciones").update({"activo": False}).eq("usuario_id", uid).eq("correo", viejo).eq("activo", True).execute()
-        supabase.table("correos").upsert({"correo": nuevo, "vencimiento": fecha_venc}, on_conflict="correo").execute()
-        supabase.table("asignaciones").insert({
-            "correo": nuevo, "usuario_id": uid, "fecha_venc": fecha_venc,
-            "asignado_por": "reemplazo", "activo": True
-        }).execute()
-        recalc_cuentas_asignadas(uid)
-        supabase.table("reemplazos_solicitudes").update({"estado": "aceptado"}).eq("id", req["id"]).execute()
+        try:
+            res = await db.liquidar_reemplazo(req["id"], uid, viejo, nuevo)
+        except Exception:
+            reemplazos.en_curso.registrar(req)   # sigue 'aceptado' en la base
+            raise
+        fecha_venc = res["fecha_venc"]
 
         try:
             await app.bot.send_message(
@@ -961,17 +1004,70 @@ async def on_any_message(event):
         except Exception:
             pass
 
-        await notify_admins(
+        notify_admins(
             "🟢 Reemplazo aplicado\n" +
             fmt_kv(Viejo=viejo, Nuevo=nuevo, User_ID=uid),
-            keyboard=None
+            grupo="vip_aplicados", titulo="🟢 Reemplazos aplicados",
+            linea=f"• {esc(viejo)} → {esc(nuevo)} (ID {uid})",
         )
 
     except Exception as e:
-        log.warning(f"on_any_message error: {e}")
+        log.warning(f"on_vip_message error: {e}")
+# Líneas "correo;dd/mm/aaaa" -> {correo: (fecha_iso, línea)}; si un correo se repite, gana la última fecha
+def parse_correo_lines(lines: list[str]) -> tuple[dict[str, tuple[str, str]], list[str]]:
+    rows, bad = {}, []
+    for ln in lines:
+        parts = re.split(r"[;, \t]+", ln)
+        if len(parts) < 2: bad.append(ln); continue
+        correo = parts[0].lower()
+        fecha_iso = parse_date_str(parts[1])
+        if not fecha_iso: bad.append(ln); continue
+        rows[correo] = (fecha_iso, ln)
+    return rows, bad
+
+async def _edit_progress(msg, text: str):
+    if msg is None: return
+    try: await msg.edit_text(text)
+    except Exception: pass
+
+# Importación masiva de correos (texto o .txt): un upsert por lote de IMPORT_CHUNK filas
+async def importar_correos(update: Update, lines: list[str]):
+    rows, bad = parse_correo_lines(lines)
+    items = list(rows.items())
+    total = len(items)
+    progreso = None
+    if total > IMPORT_CHUNK:
+        progreso = await update.message.reply_text(f"⏳ Importando {total} correos…")
+
+    ok = 0
+    for i in range(0, total, IMPORT_CHUNK):
+        chunk = items[i:i + IMPORT_CHUNK]
+        try:
+            await db.upsert_correos([{"correo": c, "vencimiento": f} for c, (f, _) in chunk])
+            ok += len(chunk)
+        except Exception:
+            # Falló el lote: fila a fila para reportar qué líneas dan error
+            for c, (f, ln) in chunk:
+                try:
+                    await db.upsert_correo(c, f)
+                    ok += 1
+                except Exception as e:
+                    bad.append(f"{ln} ({e})")
+        await _edit_progress(progreso, f"⏳ Importando… {min(i + IMPORT_CHUNK, total)}/{total}")
+
+    msg = f"✅ Registrados: {ok}"
+    if bad: msg += f"\n❌ Errores ({len(bad)}):\n" + "\n".join(f"- {b}" for b in bad[:20])
+    if progreso is not None:
+        try:
+            await progreso.edit_text(msg)
+            return
+        except Exception:
+            pass
+    await update.message.reply_text(msg)
+
 async def cmd_registrarcorreos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     if role not in ("admin","owner"):
         await say_err(update, "No autorizado.")
         return
@@ -985,43 +1081,27 @@ async def cmd_registrarcorreos(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     lines = [ln.strip() for ln in lines_text.splitlines() if ln.strip()]
-    ok, bad = 0, []
-    for ln in lines:
-        parts = re.split(r"[;, \t]+", ln)
-        if len(parts) < 2: bad.append(ln); continue
-        correo = parts[0].lower()
-        fecha_iso = parse_date_str(parts[1])
-        if not fecha_iso: bad.append(ln); continue
-        try:
-            supabase.table("correos").upsert({"correo": correo, "vencimiento": fecha_iso}, on_conflict="correo").execute()
-            ok += 1
-        except Exception as e:
-            bad.append(f"{ln} ({e})")
-
-    msg = f"✅ Registrados: {ok}"
-    if bad: msg += f"\n❌ Errores ({len(bad)}):\n" + "\n".join(f"- {b}" for b in bad[:20])
-    await update.message.reply_text(msg)
+    await importar_correos(update, lines)
 
 async def _assign_one(correo: str, fecha_iso: str, target: str) -> tuple[bool, str]:
     correo = correo.lower().strip()
     if not correo or not fecha_iso or not target: return False, "datos inválidos"
-    owner = buscar_duenho_por_correo_activo(correo)
+    owner = await buscar_duenho_por_correo_activo(correo)
     if owner and str(owner["usuario_id"]) != str(target):
         return False, "correo asignado a otro usuario"
     try:
-        supabase.table("correos").upsert({"correo": correo, "vencimiento": fecha_iso}, on_conflict="correo").execute()
-        if obtener_asignacion_activa(target, correo):
-            supabase.table("asignaciones").update({"fecha_venc": fecha_iso}).eq("usuario_id", target).eq("correo", correo).eq("activo", True).execute()
+        await db.upsert_correo(correo, fecha_iso)
+        if await obtener_asignacion_activa(target, correo):
+            await db.actualizar_venc_asignacion(target, correo, fecha_iso)
         else:
-            supabase.table("asignaciones").insert({"correo": correo, "usuario_id": target, "fecha_venc": fecha_iso, "asignado_por": "admin", "activo": True}).execute()
-        recalc_cuentas_asignadas(target)
+            await db.insertar_asignacion(correo, target, fecha_iso, "admin")
         return True, ""
     except Exception as e:
         return False, str(e)
 
 async def cmd_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     if role not in ("admin","owner"):
         await say_err(update, "No autorizado."); return
 
@@ -1051,7 +1131,7 @@ async def cmd_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_remover(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     if role not in ("admin","owner"):
         await say_err(update, "No autorizado."); return
 
@@ -1065,8 +1145,7 @@ async def cmd_remover(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        supabase.table("asignaciones").update({"activo": False}).eq("usuario_id", target).eq("correo", correo).eq("activo", True).execute()
-        recalc_cuentas_asignadas(target)
+        await db.desactivar_asignacion(target, correo)
         await say_ok(update, f"Removido {pill(correo)} de {pill(target)}.")
     except Exception as e:
         await say_err(update, f"Error: {esc(e)}")
@@ -1074,7 +1153,7 @@ async def cmd_remover(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Documentos .txt
 async def doc_registrarcorreos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    if get_role(uid) not in ("admin","owner"):
+    if await get_role(uid) not in ("admin","owner"):
         await say_err(update, "No autorizado."); return
     doc = update.message.document
     if not doc or (doc.mime_type or "") != "text/plain":
@@ -1083,25 +1162,11 @@ async def doc_registrarcorreos(update: Update, context: ContextTypes.DEFAULT_TYP
     data = await file.download_as_bytearray()
     text = data.decode("utf-8", errors="ignore")
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    ok, bad = 0, []
-    for ln in lines:
-        parts = re.split(r"[;, \t]+", ln)
-        if len(parts) < 2: bad.append(ln); continue
-        correo = parts[0].lower()
-        fecha_iso = parse_date_str(parts[1])
-        if not fecha_iso: bad.append(ln); continue
-        try:
-            supabase.table("correos").upsert({"correo": correo, "vencimiento": fecha_iso}, on_conflict="correo").execute()
-            ok += 1
-        except Exception as e:
-            bad.append(f"{ln} ({e})")
-    msg = f"✅ Registrados: {ok}"
-    if bad: msg += f"\n❌ Errores ({len(bad)}):\n" + "\n".join(f"- {b}" for b in bad[:20])
-    await update.message.reply_text(msg)
+    await importar_correos(update, lines)
 
 async def doc_asignar_remover(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    role = get_role(uid)
+    role = await get_role(uid)
     if role not in ("admin","owner"):
         await say_err(update, "No autorizado."); return
     caption = (update.message.caption or "").strip()
@@ -1121,37 +1186,140 @@ async def doc_asignar_remover(update: Update, context: ContextTypes.DEFAULT_TYPE
     text = data.decode("utf-8", errors="ignore")
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
 
-    ok, bad = 0, []
+    # Todo el archivo de una vez: lecturas/escrituras por lote (el contador lo lleva el trigger)
     if m_asig:
-        for ln in lines:
-            parts = re.split(r"[;, \t]+", ln)
-            if len(parts) < 2: bad.append(ln); continue
-            correo = parts[0].lower()
-            fecha_iso = parse_date_str(parts[1])
-            if not fecha_iso: bad.append(ln); continue
-            ok1, err = await _assign_one(correo, fecha_iso, target)
-            if ok1: ok += 1
-            else: bad.append(f"{ln} ({err})")
+        rows, bad = parse_correo_lines(lines)
+        errores = await db.asignar_lote(target, {c: f for c, (f, _) in rows.items()})
+        bad += [f"{rows[c][1]} ({err})" for c, err in errores.items()]
+        ok = len(rows) - len(errores)
         await update.message.reply_text(f"📎 Asignados: {ok}\n❌ Errores: {len(bad)}" + (("\n" + "\n".join(bad[:20])) if bad else ""))
     else:
-        for ln in lines:
-            correo = ln.split()[0].lower()
-            try:
-                supabase.table("asignaciones").update({"activo": False}).eq("usuario_id", target).eq("correo", correo).eq("activo", True).execute()
-                ok += 1
-            except Exception as e:
-                bad.append(f"{ln} ({e})")
-        recalc_cuentas_asignadas(target)
+        por_correo = {ln.split()[0].lower(): ln for ln in lines}
+        errores = await db.desactivar_asignaciones(target, list(por_correo))
+        bad = [f"{por_correo[c]} ({err})" for c, err in errores.items()]
+        ok = len(por_correo) - len(errores)
         await update.message.reply_text(f"🗑️ Removidos: {ok}\n❌ Errores: {len(bad)}" + (("\n" + "\n".join(bad[:20])) if bad else ""))
 
 
 
+# --- calentamiento
+# Antes de escuchar: entidades de los bots externos, semilla de owner/admins, cachés (roles,
+# admins, clientes, propiedad) y conexiones abiertas. Cada paso se cronometra; uno que falla se
+# registra y ese recurso queda perezoso (se resolverá en la primera petición).
+async def _paso(nombre: str, coro) -> bool:
+    t0 = time.monotonic()
+    try:
+        r = await coro
+        log.info(f"Calentamiento · {nombre}{'' if r is None else f': {r}'} ({time.monotonic() - t0:.2f}s)")
+        return True
+    except Exception as e:
+        log.warning(f"Calentamiento · {nombre} falló ({time.monotonic() - t0:.2f}s): {e}")
+        return False
+
+async def _entidades():
+    ents = await asyncio.gather(*(get_entity_cached(u) for u in (SERVICIO_VIP, CODIGOS_NETFLIX)))
+    for u, e in zip((SERVICIO_VIP, CODIGOS_NETFLIX), ents):
+        outbound.scheduler(client, e, u)
+    return ", ".join(f"{u}={e.id}" for u, e in zip((SERVICIO_VIP, CODIGOS_NETFLIX), ents))
+
+# Escucha solo el chat del VIP; si no se resuelve al arrancar se reintenta en segundo plano
+async def _escuchar_vip():
+    vip = await get_entity_cached(VIP_REEMPLAZARBOT)
+    client.add_event_handler(on_vip_message, events.NewMessage(chats=[vip.id], incoming=True))
+    return f"{VIP_REEMPLAZARBOT}={vip.id}"
+
+async def _reintentar_vip(espera: float = 30):
+    while True:
+        await asyncio.sleep(espera)
+        try:
+            log.info(f"Escucha del VIP activa: {await _escuchar_vip()}")
+            return
+        except Exception as e:
+            espera = min(espera * 2, 600)
+            log.warning(f"No se pudo resolver {VIP_REEMPLAZARBOT} ({e}); reintento en {espera:.0f}s")
+
+async def _esquema():
+    faltan = await db.descubrir_esquema()
+    if faltan: log.warning(f"Esquema: faltan {', '.join(faltan)}")
+    return f"columna de cliente = {await db.detect_admin_client_col()}"
+
+async def _admins():
+    ids = await db.admin_ids()
+    await asyncio.gather(*(admin_client_ids(a) for a in ids))
+    return f"{len(ids)} admins/owner con sus clientes"
+
+async def _auditoria():
+    return f"{await audit.reenviar_volcados()} registros volcados reenviados"
+
+async def _reemplazos():
+    reemplazos.en_curso.cargar(await db.reemplazos_en_curso())
+    return f"{len(reemplazos.en_curso)} esperando al VIP"
+
+async def _bot():
+    await app.initialize()
+    return f"@{app.bot.username}"
+
+async def calentar() -> bool:
+    t0 = time.monotonic()
+
+    async def base():
+        # El esquema abre la conexión; la semilla va antes de cargar admins (la invalida).
+        ok = await _paso("esquema", _esquema())
+        ok &= await _paso("owner/admins", ensure_owner_and_seed_admins())
+        return ok & all(await asyncio.gather(
+            _paso("roles en caché", db.precargar_roles()),
+            _paso("admins", _admins()),
+            _paso("asignaciones activas (propiedad)", db.cargar_propiedad()),
+            pendientes(),
+            _paso("reemplazos", _reemplazos()),
+        ))
+
+    # Lo volcado se reenvía antes de expirar: un insert 'pendiente' reenviado después quedaría vivo
+    # (la expiración marca todas las 'pendiente', sin corte por antigüedad)
+    async def pendientes():
+        ok = await _paso("auditoría", _auditoria())
+        return ok & await _paso("operaciones pendientes", operaciones.reap())
+
+    async def vip():
+        if await _paso("escucha VIP", _escuchar_vip()):
+            return True
+        _background.append(asyncio.create_task(_reintentar_vip()))
+        return False
+
+    ok = all(await asyncio.gather(base(), _paso("entidades", _entidades()), vip(), _paso("Bot API", _bot())))
+    log.info(f"Calentamiento {'completo' if ok else 'incompleto'} en {time.monotonic() - t0:.2f}s")
+    return ok
+
+
+# Tras detener el polling (post_shutdown de PTB): vaciar auditoría, guardar límites, cerrar la base
+async def al_cerrar(_app):
+    for t in _background:
+        t.cancel()
+    await audit.drain()
+    ratelimit.guardar()
+    await db.close()
+
+
 async def main():
     await client.start()
+    outbound.attach(client)
     log.info("Sesión de Telethon iniciada")
 
     global app
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder().token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .connection_pool_size(BOT_POOL_SIZE)
+        .post_shutdown(al_cerrar)
+        .build()
+    )
+    avisos.iniciar(app.bot)
+
+    listo = await calentar()
+    _background.append(asyncio.create_task(db.resync_propiedad()))
+    _background.append(asyncio.create_task(db.reconciliar_cuentas()))
+    log.info(f"Límites restaurados: {ratelimit.cargar()} usuarios")
+    _background.append(asyncio.create_task(ratelimit.persistir()))
 
     # Base
     app.add_handler(CommandHandler("start", cmd_start))
@@ -1175,11 +1343,14 @@ async def main():
     app.add_handler(CommandHandler("miusuario", cmd_miusuario))
     app.add_handler(CommandHandler("misuario", cmd_misuario))
     app.add_handler(CommandHandler("registraradmin", cmd_registraradmin))
+    app.add_handler(CommandHandler("estado", cmd_estado))
 
     # Reemplazos
     app.add_handler(CommandHandler("reemplazar", cmd_reemplazar))
     app.add_handler(CommandHandler("reemplazarvip", cmd_reemplazarvip))
+    app.add_handler(CommandHandler("reemplazos", cmd_reemplazos))
     app.add_handler(CallbackQueryHandler(on_reemp_callback, pattern=r"^reemp_"))
+    app.add_handler(CallbackQueryHandler(on_reemps_nav, pattern=r"^reemps:[dh]:\d+$"))
 
     # Masivos
     app.add_handler(CommandHandler("registrarcorreos", cmd_registrarcorreos))
@@ -1190,8 +1361,15 @@ async def main():
     app.add_handler(MessageHandler(filters.Document.MimeType("text/plain") & filters.CaptionRegex(r"^/registrarcorreos\b"), doc_registrarcorreos))
     app.add_handler(MessageHandler(filters.Document.MimeType("text/plain") & (filters.CaptionRegex(r"^/asignar\s+\d+$") | filters.CaptionRegex(r"^/remover\s+\d+$")), doc_asignar_remover))
 
-    log.info("🤖 Bot listo. Escuchando…")
-    await app.run_polling()
+    app.add_error_handler(on_error)
+
+    # Cada handler corre en el carril de su usuario: orden por usuario, paralelo entre usuarios
+    for h in app.handlers.get(0, []):
+        h.callback = per_user(h.callback)
+
+    log.info("🤖 Bot listo. Escuchando…" if listo else "🤖 Bot escuchando (calentamiento incompleto, ver avisos)")
+    # run_polling es síncrono (nest_asyncio); el bucle es de asyncio.run, no debe cerrarlo
+    app.run_polling(close_loop=False)
 
 if __name__ == "__main__":
     asyncio.run(main())
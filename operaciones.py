@@ -0,0 +1,65 @@
+# operaciones.py — registro en memoria de operaciones en curso por usuario
+# (la tabla operaciones queda como bitácora: se escribe en segundo plano vía audit)
+import json, time, asyncio, itertools, logging
+
+import db
+import audit
+
+
+log = logging.getLogger("operaciones")
+
+
+class Operacion:
+    __slots__ = ("key", "uid", "tipo", "correo", "t0", "task", "fila")
+
+    def __init__(self, key: int, uid: str, tipo: str, correo: str | None):
+        self.key, self.uid, self.tipo, self.correo = key, uid, tipo, correo
+        self.t0 = time.monotonic()
+        self.task = asyncio.current_task()   # handler dueño de la operación
+        self.fila: audit.Fila | None = None
+
+
+_seq = itertools.count(1)
+_activas: dict[str, dict[int, Operacion]] = {}   # usuario -> operaciones en curso
+
+
+# Si el handler murió por una excepción sin llegar a terminar(), la operación se cierra aquí
+def ocupado(uid: str) -> bool:
+    ops = _activas.get(str(uid))
+    for op in list(ops.values()) if ops else ():
+        if op.task is not None and op.task.done():
+            terminar(op, "fallido", raw_resp="handler terminó sin cerrar la operación")
+    return bool(_activas.get(str(uid)))
+
+def activas() -> int:
+    return sum(len(ops) for ops in _activas.values())
+
+# Sin await entre la comprobación (ocupado) y el alta: dentro del loop es atómico.
+def iniciar(uid: str, tipo: str, correo: str | None, payload: str | None) -> Operacion:
+    op = Operacion(next(_seq), str(uid), tipo, correo)
+    _activas.setdefault(op.uid, {})[op.key] = op
+    op.fila = audit.insertar("operaciones", {
+        "usuario_id": op.uid,
+        "tipo": tipo,
+        "payload": json.dumps({"correo": correo, "raw": payload}) if (correo or payload) else None,
+        "estado": "pendiente",
+    })
+    return op
+
+def terminar(op: Operacion, estado: str, raw_resp: str | None = None):
+    ops = _activas.get(op.uid)
+    if ops is None or ops.pop(op.key, None) is None:
+        return
+    if not ops:
+        del _activas[op.uid]
+    data = {"estado": estado}
+    if raw_resp is not None:
+        data["raw_resp"] = raw_resp
+    audit.actualizar(op.fila, data)
+
+# Al arrancar el registro está vacío: las filas 'pendiente' que quedan son de un proceso caído
+async def reap() -> int:
+    n = await db.expirar_operaciones()
+    if n:
+        log.info(f"operaciones: {n} pendientes huérfanas marcadas como fallidas")
+    return n
@@ -0,0 +1,301 @@
+# outbound.py — comunicación con los bots externos (SERVICIO_VIP, CODIGOS_NETFLIX, VIP_REEMPLAZARBOT)
+import os, re, time, asyncio, itertools, logging
+from collections import OrderedDict, deque
+
+from telethon import events
+from telethon.errors import FloodWaitError
+
+
+log = logging.getLogger("outbound")
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+# Ritmo de envío por bot destino (token bucket) y tamaño máximo de su cola
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "1.0"))     # mensajes/seg
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "3"))
+OUTBOUND_QUEUE_MAX = int(os.getenv("OUTBOUND_QUEUE_MAX", "500"))
+# Consultas idénticas (bot, comando, correo) dentro de esta ventana comparten un solo envío
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "30"))
+# Tras rendirse una petición, las respuestas que nombren su correo se descartan durante esta ventana
+LATE_REPLY_WINDOW = float(os.getenv("LATE_REPLY_WINDOW", "600"))
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class Waiter:
+    __slots__ = ("seq", "correo", "cmd", "acepta", "msg_id", "fut")
+
+    def __init__(self, seq: int, correo: str | None, cmd: str, acepta, fut: asyncio.Future):
+        self.seq, self.correo, self.cmd, self.acepta, self.fut = seq, correo, cmd, acepta, fut
+        self.msg_id: int | None = None
+
+
+# Un despachador por bot externo: tabla de peticiones en curso.
+# Una respuesta que cita un mensaje nuestro va a quien lo envió. Si no, a quien espera el correo
+# que nombra. Si no hay nadie, va al más antiguo cuyo comando la acepte (`acepta`, p.ej. /comprar
+# solo acepta "Cuenta: …"), pero nunca se da a quien espera otro correo. Una respuesta que cita un
+# mensaje ya abandonado, o que nombra el correo de una petición que se rindió hace poco, llegó
+# tarde y se descarta. Si cita un mensaje que aún no conocemos (el bot respondió antes de que el
+# envío quedara registrado), se empareja como si no citara nada.
+class ReplyRouter:
+    def __init__(self, name: str):
+        self.name = name
+        self._seq = itertools.count()
+        self._pending: OrderedDict[int, Waiter] = OrderedDict()
+        self._by_correo: dict[str, deque[Waiter]] = {}
+        self._by_msg: dict[int, Waiter] = {}
+        self._tardias: OrderedDict[str | int, float] = OrderedDict()   # correo / msg_id abandonado -> hasta cuándo
+        self.descartadas = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def expect(self, correo: str | None, cmd: str, acepta=None) -> Waiter:
+        w = Waiter(next(self._seq), correo, cmd, acepta, asyncio.get_running_loop().create_future())
+        self._pending[w.seq] = w
+        if correo:
+            self._by_correo.setdefault(correo, deque()).append(w)
+        return w
+
+    def enviado(self, w: Waiter, msg_id: int):
+        if w.seq in self._pending:
+            w.msg_id = msg_id
+            self._by_msg[msg_id] = w
+
+    def discard(self, w: Waiter):
+        if self._quitar(w):
+            hasta = time.monotonic() + LATE_REPLY_WINDOW
+            for k in (w.correo, w.msg_id):
+                if k is not None:
+                    self._tardias[k] = hasta
+                    self._tardias.move_to_end(k)
+
+    def _quitar(self, w: Waiter) -> bool:
+        if self._pending.pop(w.seq, None) is None:
+            return False
+        q = self._by_correo.get(w.correo) if w.correo else None
+        if q is not None:
+            try: q.remove(w)
+            except ValueError: pass
+            if not q: del self._by_correo[w.correo]
+        if w.msg_id is not None:
+            self._by_msg.pop(w.msg_id, None)
+        return True
+
+    def _tardia(self, clave: str | int) -> bool:
+        now = time.monotonic()
+        while self._tardias and next(iter(self._tardias.values())) < now:
+            self._tardias.popitem(last=False)
+        return clave in self._tardias
+
+    def _elegir(self, text: str, reply_to: int | None) -> Waiter | None:
+        if reply_to is not None:
+            if reply_to in self._by_msg:
+                return self._by_msg[reply_to]
+            if self._tardia(reply_to):
+                return None
+        correos = EMAIL_RE.findall(text.lower())
+        for correo in correos:
+            q = self._by_correo.get(correo)
+            if q:
+                return q[0]
+        if any(self._tardia(c) for c in correos):
+            return None
+        for w in self._pending.values():
+            if correos and w.correo:
+                continue
+            if w.acepta is None or w.acepta(text):
+                return w
+        return None
+
+    def dispatch(self, text: str, reply_to: int | None = None) -> bool:
+        w = self._elegir(text, reply_to)
+        if w is None:
+            self.descartadas += 1
+            log.info(f"Respuesta de {self.name} sin destinatario, descartada: {text[:80]!r}")
+            return False
+        self._quitar(w)
+        if not w.fut.done():
+            w.fut.set_result(text)
+        return True
+
+
+_routers: dict[int, ReplyRouter] = {}   # chat_id del bot → despachador
+
+
+# Para /estado: consultar no crea el despachador (crearlo cambiaría qué mensajes se enrutan)
+def descartadas(chat_id: int) -> int:
+    r = _routers.get(chat_id)
+    return r.descartadas if r is not None else 0
+
+
+def router(chat_id: int, name: str) -> ReplyRouter:
+    r = _routers.get(chat_id)
+    if r is None:
+        r = _routers[chat_id] = ReplyRouter(name)
+    return r
+
+async def _on_reply(event):
+    r = _routers.get(event.chat_id)
+    if r is not None:
+        r.dispatch(event.message.message or "", event.message.reply_to_msg_id)
+
+# Un único handler de Telethon para todos los bots externos (en vez de uno por petición)
+def attach(client):
+    client.add_event_handler(_on_reply, events.NewMessage(incoming=True, func=lambda e: e.chat_id in _routers))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate, self.burst = rate, burst
+        self.tokens = float(burst)
+        self.ts = time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Job:
+    __slots__ = ("uid", "text", "prio", "fut", "t0")
+
+    def __init__(self, uid: str, text: str, prio: int, fut: asyncio.Future):
+        self.uid, self.text, self.prio, self.fut = uid, text, prio, fut
+        self.t0 = time.monotonic()
+
+
+# Cola de salida por bot destino: dos clases (0 = admin/owner, 1 = usuarios), y dentro
+# de cada clase round-robin entre usuarios. Un único worker envía al ritmo del bucket
+# y ante FloodWait reencola el mensaje y espera lo que pida Telegram.
+class OutboundScheduler:
+    def __init__(self, client, entity, name: str, rate: float = OUTBOUND_RATE,
+                 burst: int = OUTBOUND_BURST, maxsize: int = OUTBOUND_QUEUE_MAX):
+        self.client, self.entity, self.name = client, entity, name
+        self.maxsize = maxsize
+        self._bucket = TokenBucket(rate, burst)
+        self._classes: tuple[OrderedDict[str, deque[_Job]], ...] = (OrderedDict(), OrderedDict())
+        self._size = 0
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.enviados = 0
+        self.flood_waits = 0
+        self.flood_hasta = 0.0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def submit(self, uid: str, text: str, prioritario: bool = False) -> asyncio.Future:
+        if self._size >= self.maxsize:
+            raise ColaLlena(self.name)
+        job = _Job(str(uid), text, 0 if prioritario else 1, asyncio.get_running_loop().create_future())
+        self._classes[job.prio].setdefault(job.uid, deque()).append(job)
+        self._size += 1
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+        return job.fut
+
+    def _next(self) -> _Job | None:
+        for cls in self._classes:
+            while cls:
+                uid, q = cls.popitem(last=False)
+                job = q.popleft()
+                if q: cls[uid] = q      # el usuario pasa al final de la ronda
+                self._size -= 1
+                if not job.fut.done():  # el que esperaba pudo haber cancelado (timeout)
+                    return job
+        return None
+
+    def _requeue_front(self, job: _Job):
+        cls = self._classes[job.prio]
+        cls.setdefault(job.uid, deque()).appendleft(job)
+        cls.move_to_end(job.uid, last=False)
+        self._size += 1
+
+    async def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            await self._bucket.take()
+            try:
+                msg = await self.client.send_message(self.entity, job.text)
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                self.flood_hasta = time.monotonic() + e.seconds
+                log.warning(f"FloodWait {self.name}: {e.seconds}s (cola={self._size + 1})")
+                self._requeue_front(job)
+                await asyncio.sleep(e.seconds + 1)
+                continue
+            except Exception as e:
+                if not job.fut.done(): job.fut.set_exception(e)
+                continue
+            espera = time.monotonic() - job.t0
+            self.enviados += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+            if not job.fut.done(): job.fut.set_result(msg)
+
+    def stats(self) -> dict:
+        return {
+            "cola": self._size,
+            "enviados": self.enviados,
+            "espera_media": round(self.espera_total / self.enviados, 2) if self.enviados else 0.0,
+            "espera_max": round(self.espera_max, 2),
+            "flood_waits": self.flood_waits,
+            "flood_restante": max(0, round(self.flood_hasta - time.monotonic())),
+        }
+
+
+_schedulers: dict[int, OutboundScheduler] = {}
+
+
+def scheduler(client, entity, name: str) -> OutboundScheduler:
+    s = _schedulers.get(entity.id)
+    if s is None:
+        s = _schedulers[entity.id] = OutboundScheduler(client, entity, name)
+    return s
+
+def schedulers() -> list[OutboundScheduler]:
+    return list(_schedulers.values())
+
+
+# Single-flight: mientras una consulta sigue en curso y no pasó la ventana desde su envío,
+# las idénticas se suman a ella y reciben la misma respuesta (o la misma excepción).
+class SingleFlight:
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        self._vuelos: dict[tuple, tuple[float, asyncio.Task]] = {}
+        self.compartidas = 0
+
+    async def do(self, key: tuple, factory):
+        ent = self._vuelos.get(key)
+        if ent is not None and not ent[1].done() and time.monotonic() - ent[0] <= self.window:
+            self.compartidas += 1
+            task = ent[1]
+        else:
+            task = asyncio.get_running_loop().create_task(factory())
+            self._vuelos[key] = (time.monotonic(), task)
+            task.add_done_callback(lambda t, k=key: self._fin(k, t))
+        # shield: si uno de los que esperan se cancela, los demás siguen esperando el mismo envío
+        return await asyncio.shield(task)
+
+    def _fin(self, key: tuple, task: asyncio.Task):
+        ent = self._vuelos.get(key)
+        if ent is not None and ent[1] is task:
+            del self._vuelos[key]
+
+    def __len__(self):
+        return len(self._vuelos)
+
+
+vuelos = SingleFlight()
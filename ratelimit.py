@@ -0,0 +1,95 @@
+# ratelimit.py — límites por usuario y clase de comando (token buckets)
+# Un bucket lleno no aporta información: cada entrada caduca cuando terminaría de recargarse,
+# así el almacén solo guarda a quien usó el bot hace poco (y nunca pasa de RATELIMIT_MAX).
+import os, json, time, asyncio, logging
+
+from cache import TTLCache
+
+
+log = logging.getLogger("ratelimit")
+
+RATELIMIT_MAX = int(os.getenv("RATELIMIT_MAX", "100000"))
+RATELIMIT_STATE = os.getenv("RATELIMIT_STATE", "ratelimit_state.json")
+COOLDOWN_SECONDS = float(os.getenv("COOLDOWN_SECONDS", "5.5"))
+
+# rol -> clase -> (tokens/seg, ráfaga). Roles sin entrada usan "user"; un dict vacío = sin límite.
+POLITICAS: dict[str, dict[str, tuple[float, int]]] = {
+    "owner": {},
+    "admin": {},
+    "user": {
+        "externo": (1 / COOLDOWN_SECONDS, 1),     # reenvíos, compras, renovaciones, reemplazos
+    },
+}
+
+_buckets = TTLCache(RATELIMIT_MAX, 0)   # (uid, clase) -> [tokens, ts monotónico]
+
+
+def politica(rol: str, clase: str) -> tuple[float, int] | None:
+    return POLITICAS.get(rol, POLITICAS["user"]).get(clase)
+
+# Devuelve 0 si se permite (y consume un token); si no, los segundos a esperar
+def tomar(uid: str, rol: str, clase: str) -> float:
+    pol = politica(rol, clase)
+    if pol is None:
+        return 0.0
+    rate, burst = pol
+    key = (str(uid), clase)
+    now = time.monotonic()
+    b = _buckets.get(key)
+    tokens = burst if b is None else min(burst, b[0] + (now - b[1]) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    tokens -= 1
+    _buckets.set(key, [tokens, now], ttl=(burst - tokens) / rate)
+    return 0.0
+
+def tamanho() -> int:
+    return len(_buckets)
+
+
+# --- persistencia (para que un reinicio no regale ráfagas)
+def exportar() -> dict:
+    now_m, now_w = time.monotonic(), time.time()
+    return {f"{k[0]}|{k[1]}": [b[0], now_w - (now_m - b[1])] for k, b, _ in _buckets.items()}
+
+def importar(data: dict) -> int:
+    now_m, now_w = time.monotonic(), time.time()
+    n = 0
+    for k, (tokens, ts_w) in data.items():
+        uid, _, clase = k.partition("|")
+        pol = politica("user", clase)
+        if pol is None:
+            continue
+        rate, burst = pol
+        ts = now_m - max(0.0, now_w - ts_w)
+        lleno = tokens + (now_m - ts) * rate
+        if lleno < burst:
+            _buckets.set((uid, clase), [tokens, ts], ttl=(burst - lleno) / rate)
+            n += 1
+    return n
+
+def guardar(path: str = RATELIMIT_STATE):
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(exportar(), fh)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning(f"No se pudo guardar el estado de límites: {e}")
+
+# Purga las entradas caducadas y guarda el estado cada `cada` segundos
+async def persistir(cada: float = 60):
+    while True:
+        await asyncio.sleep(cada)
+        _buckets.purge()
+        guardar()
+
+def cargar(path: str = RATELIMIT_STATE) -> int:
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return importar(json.load(fh))
+    except Exception as e:
+        log.warning(f"No se pudo cargar el estado de límites: {e}")
+        return 0
@@ -0,0 +1,53 @@
+# reemplazos.py — solicitudes de reemplazo enviadas al VIP y aún sin respuesta
+# Índice por correo + orden de envío. Las respuestas del VIP se emparejan en O(1):
+# éxito → por el correo viejo; rechazo → por el correo si lo trae, si no la más antigua enviada.
+# El estado vive en la base (estado 'aceptado'), así que tras un reinicio se reconstruye.
+from collections import OrderedDict, deque
+
+from outbound import EMAIL_RE
+
+
+class EnCurso:
+    def __init__(self):
+        self._orden: OrderedDict[int, dict] = OrderedDict()   # id -> solicitud, en orden de envío
+        self._by_correo: dict[str, deque[int]] = {}
+
+    def __len__(self):
+        return len(self._orden)
+
+    def registrar(self, req: dict):
+        rid = int(req["id"])
+        if rid in self._orden:
+            return
+        self._orden[rid] = req
+        self._by_correo.setdefault(req["correo"], deque()).append(rid)
+
+    def quitar(self, rid: int) -> dict | None:
+        req = self._orden.pop(int(rid), None)
+        if req is not None:
+            q = self._by_correo.get(req["correo"])
+            if q is not None:
+                try: q.remove(int(rid))
+                except ValueError: pass
+                if not q: del self._by_correo[req["correo"]]
+        return req
+
+    def por_correo(self, correo: str) -> dict | None:
+        q = self._by_correo.get(correo)
+        return self.quitar(q[0]) if q else None
+
+    def para_rechazo(self, text: str) -> dict | None:
+        for correo in EMAIL_RE.findall(text.lower()):
+            req = self.por_correo(correo)
+            if req is not None:
+                return req
+        return self.quitar(next(iter(self._orden))) if self._orden else None
+
+    def cargar(self, rows: list[dict]):
+        self._orden.clear()
+        self._by_correo.clear()
+        for r in rows:
+            self.registrar(r)
+
+
+en_curso = EnCurso()
@@ -0,0 +1,121 @@
+-- Liquidación de compra / renovación / reemplazo en una sola llamada RPC (una transacción).
+-- Ejecutar en el SQL Editor de Supabase.
+
+-- Compra: asigna el correo al usuario por p_dias, descuenta 1 crédito y lo registra.
+-- Sin saldo (comprobado bajo el bloqueo de la fila) o si el correo ya está activo para otro
+-- usuario no escribe nada y devuelve {"error": ...}.
+create or replace function public.liquidar_compra(p_usuario_id text, p_correo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date := current_date + p_dias;
+  v_saldo int;
+  v_creditos int;
+  v_cuentas int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if coalesce(v_saldo, 0) < 1 then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  if exists (select 1 from asignaciones where correo = p_correo and activo and usuario_id <> p_usuario_id) then
+    return json_build_object('error', 'correo_asignado_a_otro');
+  end if;
+
+  insert into correos (correo, vencimiento) values (p_correo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+
+  update asignaciones set fecha_venc = v_venc
+   where usuario_id = p_usuario_id and correo = p_correo and activo;
+  if not found then
+    insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+    values (p_correo, p_usuario_id, v_venc, 'servicio_vip', true);
+  end if;
+
+  update usuarios set creditos = creditos - 1
+   where telegram_id = p_usuario_id
+  returning creditos into v_creditos;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, -1, 'compra', 'servicio_vip');
+
+  select count(*) into v_cuentas from asignaciones where usuario_id = p_usuario_id and activo;
+  update usuarios set cuentas_asignadas = v_cuentas where telegram_id = p_usuario_id;
+
+  return json_build_object('fecha_venc', v_venc, 'creditos', v_creditos, 'cuentas', v_cuentas);
+end $$;
+
+-- Renovación: extiende p_dias desde la mayor entre hoy y el vencimiento actual.
+-- Sin saldo no escribe nada y devuelve {"error": "saldo_insuficiente"}.
+create or replace function public.liquidar_renovacion(p_usuario_id text, p_correo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_actual date;
+  v_venc date;
+  v_saldo int;
+  v_creditos int;
+  v_cuentas int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if coalesce(v_saldo, 0) < 1 then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  select fecha_venc into v_actual from asignaciones
+   where usuario_id = p_usuario_id and correo = p_correo and activo
+   limit 1 for update;
+  v_venc := greatest(coalesce(v_actual, current_date), current_date) + p_dias;
+
+  insert into correos (correo, vencimiento) values (p_correo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+
+  update asignaciones set fecha_venc = v_venc
+   where usuario_id = p_usuario_id and correo = p_correo and activo;
+  if not found then
+    insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+    values (p_correo, p_usuario_id, v_venc, 'renovacion', true);
+  end if;
+
+  update usuarios set creditos = creditos - 1
+   where telegram_id = p_usuario_id
+  returning creditos into v_creditos;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, -1, 'renovacion', 'servicio_vip');
+
+  select count(*) into v_cuentas from asignaciones where usuario_id = p_usuario_id and activo;
+  update usuarios set cuentas_asignadas = v_cuentas where telegram_id = p_usuario_id;
+
+  return json_build_object('fecha_venc', v_venc, 'creditos', v_creditos, 'cuentas', v_cuentas);
+end $$;
+
+-- Reemplazo: el correo nuevo hereda el vencimiento del viejo (o hoy + p_dias si no había).
+create or replace function public.liquidar_reemplazo(p_solicitud_id bigint, p_usuario_id text, p_viejo text, p_nuevo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date;
+  v_cuentas int;
+begin
+  select fecha_venc into v_venc from asignaciones
+   where usuario_id = p_usuario_id and correo = p_viejo and activo
+   limit 1 for update;
+  v_venc := coalesce(v_venc, current_date + p_dias);
+
+  update asignaciones set activo = false
+   where usuario_id = p_usuario_id and correo = p_viejo and activo;
+
+  insert into correos (correo, vencimiento) values (p_nuevo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+  insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+  values (p_nuevo, p_usuario_id, v_venc, 'reemplazo', true);
+
+  select count(*) into v_cuentas from asignaciones where usuario_id = p_usuario_id and activo;
+  update usuarios set cuentas_asignadas = v_cuentas where telegram_id = p_usuario_id;
+
+  update reemplazos_solicitudes set estado = 'aceptado' where id = p_solicitud_id;
+
+  return json_build_object('fecha_venc', v_venc, 'cuentas', v_cuentas);
+end $$;
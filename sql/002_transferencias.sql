@@ -0,0 +1,74 @@
+-- Transferencia de créditos atómica (débito + abonos + historial) en una sola llamada RPC.
+-- Ejecutar en el SQL Editor de Supabase.
+
+-- Abona p_cantidad a cada destino; si p_debitar, descuenta el total (p_cantidad * destinos) a p_origen.
+-- Las filas se bloquean en orden de telegram_id para que dos transferencias cruzadas no se bloqueen
+-- entre sí. Los destinos que no existen se crean con username user_<id>.
+-- Sin saldo suficiente no escribe nada y devuelve {"error": "saldo_insuficiente", "saldo": n}.
+create or replace function public.transferir_creditos(
+  p_origen text, p_destinos text[], p_cantidad int, p_debitar boolean default true
+)
+returns json
+language plpgsql
+as $$
+declare
+  v_destinos text[];
+  v_total int;
+  v_saldo int;
+  v_motivo text;
+  v_res json;
+begin
+  select array_agg(distinct d order by d) into v_destinos
+    from unnest(p_destinos) d where d is not null and d <> '' and d <> p_origen;
+  if v_destinos is null or p_cantidad <= 0 then
+    return json_build_object('error', 'sin_destinos');
+  end if;
+  v_total := p_cantidad * array_length(v_destinos, 1);
+
+  perform 1 from usuarios
+   where telegram_id = any(v_destinos || p_origen)
+   order by telegram_id
+   for update;
+
+  if p_debitar then
+    select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_origen;
+    if coalesce(v_saldo, 0) < v_total then
+      return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+    end if;
+  end if;
+
+  -- Los destinos nuevos se crean solo una vez comprobado el saldo
+  insert into usuarios (telegram_id, username)
+  select d, 'user_' || d from unnest(v_destinos) d
+  on conflict (telegram_id) do nothing;
+
+  if p_debitar then
+    update usuarios set creditos = coalesce(creditos, 0) - v_total
+     where telegram_id = p_origen
+    returning creditos into v_saldo;
+    insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+    values (p_origen, -v_total, 'transferencia', p_origen);
+    v_motivo := 'asignacion_admin';
+  else
+    v_motivo := 'asignacion_owner';
+  end if;
+
+  with abonos as (
+    update usuarios u set creditos = coalesce(u.creditos, 0) + p_cantidad
+     where u.telegram_id = any(v_destinos)
+    returning u.telegram_id, u.username, u.creditos
+  ), hist as (
+    insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+    select telegram_id, p_cantidad, v_motivo, p_origen from abonos
+  )
+  select json_build_object(
+    'origen', v_saldo,
+    'destinos', coalesce(json_agg(json_build_object(
+      'id', telegram_id, 'username', username,
+      'antes', creditos - p_cantidad, 'ahora', creditos
+    ) order by telegram_id), '[]'::json)
+  ) into v_res
+  from abonos;
+
+  return v_res;
+end $$;
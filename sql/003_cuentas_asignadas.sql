@@ -0,0 +1,161 @@
+-- usuarios.cuentas_asignadas mantenido por trigger (deltas ±1) en lugar de recontar en cada escritura.
+-- Ejecutar en el SQL Editor de Supabase (después de 001_liquidaciones.sql).
+
+create or replace function public.asignaciones_cuenta_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') and old.activo then
+    update usuarios set cuentas_asignadas = greatest(coalesce(cuentas_asignadas, 0) - 1, 0)
+     where telegram_id = old.usuario_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') and new.activo then
+    update usuarios set cuentas_asignadas = coalesce(cuentas_asignadas, 0) + 1
+     where telegram_id = new.usuario_id;
+  end if;
+  return null;
+end $$;
+
+drop trigger if exists asignaciones_cuenta on public.asignaciones;
+create trigger asignaciones_cuenta
+after insert or delete or update of activo, usuario_id on public.asignaciones
+for each row execute function public.asignaciones_cuenta_trg();
+
+-- Reconciliación periódica (la lanza el bot en segundo plano): corrige los contadores que
+-- no coincidan con el conteo real y devuelve cuántos usuarios se tocaron.
+create or replace function public.reconciliar_cuentas_asignadas()
+returns int
+language plpgsql
+as $$
+declare
+  v_n int;
+begin
+  with conteo as (
+    select u.telegram_id, count(a.id)::int as n
+      from usuarios u
+      left join asignaciones a on a.usuario_id = u.telegram_id and a.activo
+     group by u.telegram_id
+  )
+  update usuarios u set cuentas_asignadas = conteo.n
+    from conteo
+   where u.telegram_id = conteo.telegram_id
+     and u.cuentas_asignadas is distinct from conteo.n;
+  get diagnostics v_n = row_count;
+  return v_n;
+end $$;
+
+select public.reconciliar_cuentas_asignadas();
+
+-- Liquidaciones de 001 sin el reconteo: el trigger ya dejó cuentas_asignadas al día.
+-- Compra: asigna el correo al usuario por p_dias, descuenta 1 crédito y lo registra.
+-- Sin saldo (comprobado bajo el bloqueo de la fila) o si el correo ya está activo para otro
+-- usuario no escribe nada y devuelve {"error": ...}.
+create or replace function public.liquidar_compra(p_usuario_id text, p_correo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date := current_date + p_dias;
+  v_saldo int;
+  v_creditos int;
+  v_cuentas int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if coalesce(v_saldo, 0) < 1 then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  if exists (select 1 from asignaciones where correo = p_correo and activo and usuario_id <> p_usuario_id) then
+    return json_build_object('error', 'correo_asignado_a_otro');
+  end if;
+
+  insert into correos (correo, vencimiento) values (p_correo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+
+  update asignaciones set fecha_venc = v_venc
+   where usuario_id = p_usuario_id and correo = p_correo and activo;
+  if not found then
+    insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+    values (p_correo, p_usuario_id, v_venc, 'servicio_vip', true);
+  end if;
+
+  update usuarios set creditos = creditos - 1
+   where telegram_id = p_usuario_id
+  returning creditos, cuentas_asignadas into v_creditos, v_cuentas;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, -1, 'compra', 'servicio_vip');
+
+  return json_build_object('fecha_venc', v_venc, 'creditos', v_creditos, 'cuentas', v_cuentas);
+end $$;
+
+-- Renovación: extiende p_dias desde la mayor entre hoy y el vencimiento actual.
+-- Sin saldo no escribe nada y devuelve {"error": "saldo_insuficiente"}.
+create or replace function public.liquidar_renovacion(p_usuario_id text, p_correo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_actual date;
+  v_venc date;
+  v_saldo int;
+  v_creditos int;
+  v_cuentas int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if coalesce(v_saldo, 0) < 1 then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  select fecha_venc into v_actual from asignaciones
+   where usuario_id = p_usuario_id and correo = p_correo and activo
+   limit 1 for update;
+  v_venc := greatest(coalesce(v_actual, current_date), current_date) + p_dias;
+
+  insert into correos (correo, vencimiento) values (p_correo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+
+  update asignaciones set fecha_venc = v_venc
+   where usuario_id = p_usuario_id and correo = p_correo and activo;
+  if not found then
+    insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+    values (p_correo, p_usuario_id, v_venc, 'renovacion', true);
+  end if;
+
+  update usuarios set creditos = creditos - 1
+   where telegram_id = p_usuario_id
+  returning creditos, cuentas_asignadas into v_creditos, v_cuentas;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, -1, 'renovacion', 'servicio_vip');
+
+  return json_build_object('fecha_venc', v_venc, 'creditos', v_creditos, 'cuentas', v_cuentas);
+end $$;
+
+-- Reemplazo: el correo nuevo hereda el vencimiento del viejo (o hoy + p_dias si no había).
+create or replace function public.liquidar_reemplazo(p_solicitud_id bigint, p_usuario_id text, p_viejo text, p_nuevo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date;
+  v_cuentas int;
+begin
+  select fecha_venc into v_venc from asignaciones
+   where usuario_id = p_usuario_id and correo = p_viejo and activo
+   limit 1 for update;
+  v_venc := coalesce(v_venc, current_date + p_dias);
+
+  update asignaciones set activo = false
+   where usuario_id = p_usuario_id and correo = p_viejo and activo;
+
+  insert into correos (correo, vencimiento) values (p_nuevo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+  insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+  values (p_nuevo, p_usuario_id, v_venc, 'reemplazo', true);
+
+
+  select cuentas_asignadas into v_cuentas from usuarios where telegram_id = p_usuario_id;
+  update reemplazos_solicitudes set estado = 'aceptado' where id = p_solicitud_id;
+
+  return json_build_object('fecha_venc', v_venc, 'cuentas', v_cuentas);
+end $$;
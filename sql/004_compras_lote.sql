@@ -0,0 +1,91 @@
+-- Compras por lote (/comprar N): reserva de créditos al inicio, liquidación sin cobro por cuenta
+-- y cierre con reembolso de lo no usado. Ejecutar en el SQL Editor de Supabase (después de 003).
+
+-- Reserva: descuenta p_cantidad de una vez y deja una sola fila de historial para el lote.
+-- Sin saldo suficiente no escribe nada y devuelve {"error": "saldo_insuficiente", "saldo": n}.
+create or replace function public.reservar_creditos(p_usuario_id text, p_cantidad int, p_motivo text default 'compra_lote')
+returns json
+language plpgsql
+as $$
+declare
+  v_saldo int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if coalesce(v_saldo, 0) < p_cantidad then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  update usuarios set creditos = creditos - p_cantidad
+   where telegram_id = p_usuario_id
+  returning creditos into v_saldo;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, -p_cantidad, p_motivo, 'servicio_vip');
+
+  return json_build_object('creditos', v_saldo);
+end $$;
+
+-- Cierre: devuelve los créditos reservados que no se usaron (una fila de historial si hay reembolso).
+create or replace function public.devolver_creditos(p_usuario_id text, p_cantidad int, p_motivo text default 'reembolso_lote')
+returns json
+language plpgsql
+as $$
+declare
+  v_saldo int;
+begin
+  if p_cantidad <= 0 then
+    select creditos into v_saldo from usuarios where telegram_id = p_usuario_id;
+    return json_build_object('creditos', v_saldo);
+  end if;
+
+  update usuarios set creditos = coalesce(creditos, 0) + p_cantidad
+   where telegram_id = p_usuario_id
+  returning creditos into v_saldo;
+  insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+  values (p_usuario_id, p_cantidad, p_motivo, 'servicio_vip');
+
+  return json_build_object('creditos', v_saldo);
+end $$;
+
+-- liquidar_compra gana p_cobrar: con false (crédito ya reservado) solo asigna el correo;
+-- con true comprueba el saldo bajo el bloqueo de la fila del usuario.
+drop function if exists public.liquidar_compra(text, text, int);
+
+create or replace function public.liquidar_compra(p_usuario_id text, p_correo text, p_dias int default 30, p_cobrar boolean default true)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date := current_date + p_dias;
+  v_saldo int;
+  v_creditos int;
+  v_cuentas int;
+begin
+  select coalesce(creditos, 0) into v_saldo from usuarios where telegram_id = p_usuario_id for update;
+  if p_cobrar and coalesce(v_saldo, 0) < 1 then
+    return json_build_object('error', 'saldo_insuficiente', 'saldo', coalesce(v_saldo, 0));
+  end if;
+
+  if exists (select 1 from asignaciones where correo = p_correo and activo and usuario_id <> p_usuario_id) then
+    return json_build_object('error', 'correo_asignado_a_otro');
+  end if;
+
+  insert into correos (correo, vencimiento) values (p_correo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+
+  update asignaciones set fecha_venc = v_venc
+   where usuario_id = p_usuario_id and correo = p_correo and activo;
+  if not found then
+    insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+    values (p_correo, p_usuario_id, v_venc, 'servicio_vip', true);
+  end if;
+
+  if p_cobrar then
+    update usuarios set creditos = creditos - 1
+     where telegram_id = p_usuario_id;
+    insert into creditos_historial (usuario_id, delta, motivo, hecho_por)
+    values (p_usuario_id, -1, 'compra', 'servicio_vip');
+  end if;
+  select creditos, cuentas_asignadas into v_creditos, v_cuentas from usuarios where telegram_id = p_usuario_id;
+
+  return json_build_object('fecha_venc', v_venc, 'creditos', v_creditos, 'cuentas', v_cuentas);
+end $$;
@@ -0,0 +1,36 @@
+-- Estados de reemplazos_solicitudes: pendiente → aceptado (enviado al VIP) → completado | rechazado.
+-- Las filas 'aceptado' son justo las que esperan respuesta del VIP: con ellas el bot reconstruye
+-- su tabla de correlación al arrancar. Ejecutar en el SQL Editor de Supabase (después de 004).
+
+-- Reemplazo: igual que en 003, pero la solicitud queda 'completado' (ya no 'aceptado').
+create or replace function public.liquidar_reemplazo(p_solicitud_id bigint, p_usuario_id text, p_viejo text, p_nuevo text, p_dias int default 30)
+returns json
+language plpgsql
+as $$
+declare
+  v_venc date;
+  v_cuentas int;
+begin
+  select fecha_venc into v_venc from asignaciones
+   where usuario_id = p_usuario_id and correo = p_viejo and activo
+   limit 1 for update;
+  v_venc := coalesce(v_venc, current_date + p_dias);
+
+  update asignaciones set activo = false
+   where usuario_id = p_usuario_id and correo = p_viejo and activo;
+
+  insert into correos (correo, vencimiento) values (p_nuevo, v_venc)
+    on conflict (correo) do update set vencimiento = excluded.vencimiento;
+  insert into asignaciones (correo, usuario_id, fecha_venc, asignado_por, activo)
+  values (p_nuevo, p_usuario_id, v_venc, 'reemplazo', true);
+
+  select cuentas_asignadas into v_cuentas from usuarios where telegram_id = p_usuario_id;
+  update reemplazos_solicitudes set estado = 'completado' where id = p_solicitud_id;
+
+  return json_build_object('fecha_venc', v_venc, 'cuentas', v_cuentas);
+end $$;
+
+-- Solicitudes ya liquidadas por la versión anterior (quedaron en 'aceptado' con el correo viejo inactivo)
+update reemplazos_solicitudes s set estado = 'completado'
+ where s.estado = 'aceptado'
+   and not exists (select 1 from asignaciones a where a.correo = s.correo and a.usuario_id = s.usuario_id and a.activo);
@@ -0,0 +1,43 @@
+-- /cuentas de un admin: sus asignaciones activas y las de sus clientes, cruzadas en la base con
+-- admin_clientes (sin listas de ids en la URL). Ejecutar en el SQL Editor de Supabase.
+
+-- Una página por keyset, en el mismo orden que iter_asignaciones_activas: primero las que tienen
+-- fecha por (fecha_venc, id), luego (p_sin_fecha) las que no, por id. p_col es la columna de
+-- cliente de admin_clientes que el bot resuelve al arrancar.
+create or replace function public.asignaciones_admin_pagina(
+  p_admin_id text,
+  p_col text,
+  p_sin_fecha boolean default false,
+  p_fecha date default null,
+  p_id bigint default null,
+  p_limit int default 1000
+)
+returns json
+language plpgsql
+stable
+as $$
+declare
+  v_filas json;
+begin
+  if p_col not in ('cliente_id', 'cliente', 'user_id', 'clienteId', 'client_id') then
+    raise exception 'columna de cliente no válida: %', p_col;
+  end if;
+
+  execute format($q$
+    select coalesce(json_agg(t order by t.fecha_venc, t.id), '[]'::json) from (
+      select a.id, a.usuario_id, a.correo, a.fecha_venc
+        from asignaciones a
+       where a.activo
+         and (a.usuario_id = $1
+              or a.usuario_id in (select c.%I::text from admin_clientes c where c.admin_id::text = $1))
+         and case when $2 then a.fecha_venc is null and ($4 is null or a.id > $4)
+                  else a.fecha_venc is not null and ($3 is null or (a.fecha_venc, a.id) > ($3, $4)) end
+       order by a.fecha_venc, a.id
+       limit $5
+    ) t
+  $q$, p_col)
+  into v_filas
+  using p_admin_id, p_sin_fecha, p_fecha, p_id, p_limit;
+
+  return v_filas;
+end $$;